@@ -0,0 +1,586 @@
+"""
+Benchmarks for the price data layouts, CSV ingestion and the return hot paths
+Every command runs on one synthetic dataset (prices, splits, ticker changes
+and portfolios ending on the default end date), generated into --data-dir
+and reused while the options match
+prices compares the old nested dict layout against the columnar PriceStore
+for load time, memory and lookup latency, ingest the old DictReader readers
+against streaming ingestion and the fast prices parser for rows/sec; each
+measurement runs in its own process so peak RSS isn't shared
+The fast parser (prices-fast) does not meet its 10x target over the csv
+reader: it measured 3.5 to 5x on 1M rows, one CPU
+suite times each load, lookup and return stage separately and the command
+line scripts end to end, writes the results to JSON, and flags stages slower
+than a stored baseline by more than the tolerance, exiting with status 1
+Runs offline. NumPy is optional: without it prices load through the csv
+reader instead of the fast parser, so the suite JSON records the NumPy
+version a run used, or null, for comparing against a baseline
+Usage: python benchmarks.py prices --tickers 4000 --years 10
+       python benchmarks.py ingest --portfolios portfolios.csv
+       python benchmarks.py suite --tickers 500 --years 5 --customers 5000 --save-baseline bench_baseline.json
+       python benchmarks.py suite --baseline bench_baseline.json
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from functools import partial
+
+import corporate_actions
+import investment_returns
+import returns
+from ingest import iter_portfolio_chunks
+from periods import END_DATE, TIMEFRAMES
+from portfolio_store import PortfolioStore, read_portfolio_store
+from price_store import PriceStore, iso_to_ordinal, read_price_store, read_price_store_csv
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+LOOKUPS = 100000
+OPERATIONS = 10000
+# Differences below this are timer noise, never regressions
+NOISE_SECONDS = 0.002
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def dataset_config(args):
+    # The layout and ingest commands only need prices, so leave out the rest
+    return {
+        "tickers": args.tickers,
+        "years": args.years,
+        "split_rate": getattr(args, "split_rate", 0.0),
+        "change_rate": getattr(args, "change_rate", 0.0),
+        "customers": getattr(args, "customers", 0),
+        "lots_per_customer": getattr(args, "lots_per_customer", 0),
+        "seed": args.seed,
+    }
+
+
+def write_synthetic_dataset(directory, config):
+    """
+    Weekday closes for config["tickers"] tickers over config["years"] years
+    up to END_DATE. split_rate and change_rate are the fraction of tickers
+    with one split or one ticker change; closes after a split are scaled by
+    it and rows after a change use the new ticker, like a real price dump
+    """
+    rng = random.Random(config["seed"])
+    os.makedirs(directory, exist_ok=True)
+    first_day = END_DATE - timedelta(days=365 * config["years"])
+    days = [first_day + timedelta(days=offset) for offset in range((END_DATE - first_day).days + 1)]
+    days = [day for day in days if day.weekday() < 5]
+
+    names = [f"T{number:05d}" for number in range(config["tickers"])]
+    splits = {}
+    changes = {}
+    for number, name in enumerate(names):
+        if rng.random() < config["split_rate"]:
+            from_quantity, to_quantity = rng.choice([(1, 2), (1, 3), (1, 5), (2, 1), (10, 1)])
+            splits[name] = (rng.choice(days[1:]), from_quantity, to_quantity)
+        if rng.random() < config["change_rate"]:
+            changes[name] = (rng.choice(days[1:]), f"N{number:05d}")
+
+    def current_name(name, day):
+        if name in changes and day >= changes[name][0]:
+            return changes[name][1]
+        return name
+
+    closes = {name: rng.uniform(5, 200) for name in names}
+    lot_prices = {}
+    with open(os.path.join(directory, "prices.csv"), "w", encoding="utf-8", newline="") as price_file:
+        price_file.write("date,ticker,close_price\n")
+        for day in days:
+            day_str = day.isoformat()
+            lines = []
+            for name in names:
+                closes[name] *= 1 + rng.gauss(0, 0.01)
+                if name in splits and splits[name][0] == day:
+                    closes[name] *= splits[name][1] / splits[name][2]
+                lines.append(f"{day_str},{current_name(name, day)},{closes[name]:.2f}\n")
+            price_file.writelines(lines)
+            # Only kept for the portfolios, a copy per day is a lot of memory for a prices only dataset
+            if config["customers"]:
+                lot_prices[day] = dict(closes)
+
+    with open(os.path.join(directory, "splits.csv"), "w", encoding="utf-8", newline="") as splits_file:
+        writer = csv.writer(splits_file)
+        writer.writerow(["effective_date", "ticker", "from_quantity", "to_quantity"])
+        for name, (day, from_quantity, to_quantity) in splits.items():
+            writer.writerow([f"{day.day}/{day.month}/{day.year}", current_name(name, day), from_quantity, to_quantity])
+
+    with open(os.path.join(directory, "ticker_changes.csv"), "w", encoding="utf-8", newline="") as changes_file:
+        writer = csv.writer(changes_file)
+        writer.writerow(["effective_date", "old_ticker", "new_ticker"])
+        for name, (day, new_name) in changes.items():
+            writer.writerow([f"{day.day}/{day.month}/{day.year}", name, new_name])
+
+    with open(os.path.join(directory, "portfolios.csv"), "w", encoding="utf-8", newline="") as portfolio_file:
+        writer = csv.writer(portfolio_file)
+        writer.writerow(["customer_id", "ticker", "purchase_date", "shares", "cost_basis"])
+        for customer in range(config["customers"]):
+            for _ in range(config["lots_per_customer"]):
+                name = rng.choice(names)
+                day = rng.choice(days)
+                writer.writerow([f"CUST{customer:06d}", current_name(name, day), day.isoformat(),
+                                 rng.randrange(1, 500), f"{lot_prices[day][name]:.2f}"])
+
+    with open(os.path.join(directory, "config.json"), "w", encoding="utf-8") as config_file:
+        json.dump(config, config_file)
+
+
+def dataset_matches(directory, config):
+    try:
+        with open(os.path.join(directory, "config.json"), encoding="utf-8") as config_file:
+            return json.load(config_file) == config
+    except (OSError, ValueError):
+        return False
+
+
+def generate_dataset(args):
+    # Path of the dataset's prices.csv, generating the dataset unless it matches the options
+    config = dataset_config(args)
+    if not dataset_matches(args.data_dir, config):
+        print(f"Generating dataset in {args.data_dir}", file=sys.stderr)
+        write_synthetic_dataset(args.data_dir, config)
+    return os.path.join(args.data_dir, "prices.csv")
+
+
+def read_dict_layout(path):
+    # The layout read_price_input used to build
+    data = {}
+    with open(path, encoding="utf-8") as price_file:
+        reader = csv.DictReader(price_file)
+        for row in reader:
+            ticker = row["ticker"]
+            if ticker not in data:
+                data[ticker] = {}
+            data[ticker][row["date"]] = row["close_price"]
+    return data
+
+
+def read_price_store_dictreader(path):
+    # The DictReader loop read_price_store used before streaming ingestion
+    store = PriceStore()
+    with open(path, encoding="utf-8") as price_file:
+        reader = csv.DictReader(price_file)
+        for row in reader:
+            store.add(row["ticker"], iso_to_ordinal(row["date"]), float(row["close_price"]))
+    store.build_calendars()
+    return store
+
+
+def read_portfolio_dictreader(path):
+    # The DictReader loop read_portfolio_input used before streaming ingestion
+    data = defaultdict(partial(defaultdict, list))
+    with open(path, encoding="utf-8") as portfolio_file:
+        reader = csv.DictReader(portfolio_file)
+        for row in reader:
+            data[row["customer_id"]][row["ticker"]].append({
+                "purchase_date": row["purchase_date"],
+                "shares_qty": row["shares"],
+                "cost_basis": row["cost_basis"]
+            })
+    return data
+
+
+def read_portfolio_stream(path):
+    # The nested dicts investment_returns.read_portfolio_input built before PortfolioStore
+    data = defaultdict(partial(defaultdict, list))
+    for lots in iter_portfolio_chunks(path):
+        for customer_id, ticker, purchase_date, shares_qty, cost_basis in lots:
+            data[customer_id][ticker].append({
+                "purchase_date": purchase_date,
+                "shares_qty": shares_qty,
+                "cost_basis": cost_basis
+            })
+    return data
+
+
+def filtered_price_store(read_function, path):
+    # Every tenth ticker of the first day over the final year, what a targeted query would load
+    with open(path, encoding="utf-8") as price_file:
+        reader = csv.reader(price_file)
+        next(reader)
+        first_day = next(reader)
+        tickers = [first_day[1]]
+        for row in reader:
+            if row[0] != first_day[0]:
+                break
+            tickers.append(row[1])
+    with open(path, "rb") as price_file:
+        price_file.seek(max(0, price_file.seek(0, 2) - 4096))
+        end_date = date.fromisoformat(price_file.read().decode("utf-8").split()[-1].split(",")[0])
+    return read_function(path, set(tickers[::10]), end_date - timedelta(days=365), end_date)
+
+
+INGEST_READERS = {
+    "prices-dictreader": read_price_store_dictreader,
+    "prices-stream": read_price_store_csv,
+    "prices-fast": read_price_store,
+    "prices-stream-filtered": partial(filtered_price_store, read_price_store_csv),
+    "prices-fast-filtered": partial(filtered_price_store, read_price_store),
+    "portfolio-dictreader": read_portfolio_dictreader,
+    "portfolio-stream": read_portfolio_stream,
+    "portfolio-store": read_portfolio_store,
+}
+
+
+def count_rows(path):
+    # Data rows, whether or not the last line ends in a newline
+    newlines = 0
+    last_block = b""
+    with open(path, "rb") as source_file:
+        for block in iter(lambda: source_file.read(1 << 20), b""):
+            newlines += block.count(b"\n")
+            last_block = block
+    return newlines - (1 if last_block.endswith(b"\n") else 0)
+
+
+def bench_ingest(reader, path):
+    start = time.perf_counter()
+    data = INGEST_READERS[reader](path)
+    seconds = time.perf_counter() - start
+    rows = count_rows(path)
+    if isinstance(data, PriceStore):
+        kept = len(data)
+    elif isinstance(data, PortfolioStore):
+        kept = data.lot_count()
+    else:
+        kept = sum(len(lots) for holdings in data.values() for lots in holdings.values())
+    return {
+        "reader": reader,
+        "rows": rows,
+        "rows_kept": kept,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(rows / seconds),
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def compare_ingest(prices_path, portfolios_path=None):
+    runs = [(reader, prices_path) for reader in INGEST_READERS if reader.startswith("prices")]
+    if portfolios_path:
+        runs += [(reader, portfolios_path) for reader in INGEST_READERS if reader.startswith("portfolio")]
+    results = []
+    for reader, path in runs:
+        output = subprocess.run(
+            [sys.executable, __file__, "ingest-one", reader, path],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results.append(json.loads(output))
+    return results
+
+
+def lookup_targets(tickers, first_day, last_day, seed=2):
+    rng = random.Random(seed)
+    span = (last_day - first_day).days
+    return [(rng.choice(tickers), first_day + timedelta(days=rng.randrange(span)))
+            for _ in range(LOOKUPS)]
+
+
+def bench_layout(layout, path):
+    start = time.perf_counter()
+    if layout == "dict":
+        data = read_dict_layout(path)
+        tickers = list(data)
+        all_dates = list(data[tickers[0]])
+        first_day = date.fromisoformat(all_dates[0])
+        last_day = date.fromisoformat(all_dates[-1])
+    else:
+        data = read_price_store(path)
+        tickers = data.tickers()
+        all_dates = data.dates(tickers[0])
+        first_day = date.fromordinal(all_dates[0])
+        last_day = date.fromordinal(all_dates[-1])
+    load_seconds = time.perf_counter() - start
+    rss_after_load = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    targets = lookup_targets(tickers, first_day, last_day)
+    start = time.perf_counter()
+    found = 0
+    if layout == "dict":
+        # Exact date hits only, misses fell back to a full sort per lookup
+        for ticker, day in targets:
+            close_price = data[ticker].get(day.strftime("%Y-%m-%d"))
+            if close_price is not None:
+                float(close_price)
+                found += 1
+    else:
+        for ticker, day in targets:
+            if data.close_on_or_before(ticker, day):
+                found += 1
+    lookup_seconds = time.perf_counter() - start
+
+    return {
+        "layout": layout,
+        "load_seconds": round(load_seconds, 3),
+        "peak_rss_bytes": rss_after_load,
+        "lookups": LOOKUPS,
+        "lookups_found": found,
+        "lookup_us": round(lookup_seconds / LOOKUPS * 1e6, 3),
+        "array_bytes": data.nbytes() if layout == "store" else None,
+    }
+
+
+def compare_price_layouts(path):
+    results = []
+    for layout in ("dict", "store"):
+        output = subprocess.run(
+            [sys.executable, __file__, "layout", layout, path],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results.append(json.loads(output))
+    return results
+
+
+def best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def load_modules():
+    # Both scripts read their inputs from the working directory
+    returns.price_data = investment_returns.price_data = returns.read_price_input()
+    returns.splits_data = investment_returns.splits_data = investment_returns.read_splits_input()
+    returns.ticker_changes_data = investment_returns.ticker_changes_data = \
+        investment_returns.read_ticker_changes_input()
+    investment_returns.portfolio_data = investment_returns.read_portfolio_input()
+
+
+def stage_operations(rng):
+    # Inputs for the per operation stages, drawn once so every repeat does the same work
+    tickers = investment_returns.price_data.tickers()
+    first_day = END_DATE - timedelta(days=365)
+    lookups = [(rng.choice(tickers), first_day + timedelta(days=rng.randrange(365))) for _ in range(OPERATIONS)]
+    split_tickers = list(investment_returns.splits_data) or tickers
+    split_lookups = [(rng.choice(split_tickers), first_day + timedelta(days=rng.randrange(365)))
+                     for _ in range(OPERATIONS)]
+    longest = max(tickers, key=lambda ticker: len(investment_returns.price_data.dates(ticker)))
+    date_strs = [date.fromordinal(day).isoformat() for day in investment_returns.price_data.dates(longest)]
+    rng.shuffle(date_strs)
+    return lookups, split_lookups, date_strs
+
+
+def run_stages(repeat, seed):
+    rng = random.Random(seed)
+    stages = {}
+
+    def record(name, seconds, operations=1):
+        stages[name] = {"seconds": round(seconds, 6), "operations": operations,
+                        "us_per_operation": round(seconds / operations * 1e6, 3)}
+
+    record("load_prices", best_time(returns.read_price_input, repeat))
+    record("load_splits_and_changes", best_time(lambda: (investment_returns.read_splits_input(),
+                                                         investment_returns.read_ticker_changes_input()), repeat))
+    record("load_portfolios", best_time(investment_returns.read_portfolio_input, repeat))
+    load_modules()
+    record("corporate_actions", best_time(lambda: corporate_actions.CorporateActions(
+        investment_returns.price_data, investment_returns.splits_data, investment_returns.ticker_changes_data), repeat))
+    investment_returns.get_corporate_actions()
+
+    lookups, split_lookups, date_strs = stage_operations(rng)
+    record("last_close_lookup", best_time(
+        lambda: [investment_returns.get_last_close_date(ticker, day) for ticker, day in lookups], repeat), OPERATIONS)
+    record("sort_dates", best_time(lambda: returns.sort_dates(date_strs), repeat), len(date_strs))
+    record("split_price", best_time(
+        lambda: [investment_returns.handle_split_price(ticker, day, END_DATE, 100.0) for ticker, day in split_lookups],
+        repeat), OPERATIONS)
+    record("split_position", best_time(
+        lambda: [investment_returns.handle_split_customer_position(ticker, day, END_DATE)
+                 for ticker, day in split_lookups], repeat), OPERATIONS)
+
+    tickers = investment_returns.price_data.tickers()
+    record("ticker_prices", best_time(
+        lambda: [investment_returns.get_ticker_price(ticker, timeframe)
+                 for ticker in tickers for timeframe in TIMEFRAMES], repeat), len(tickers) * len(TIMEFRAMES))
+
+    customer_ids = list(investment_returns.portfolio_data)
+    ticker_price_cache = {}
+    ticker_prices = {}
+    for customer_id in customer_ids:
+        if all(investment_returns.get_cached_ticker_price(ticker, "1 year", ticker_price_cache)
+               for ticker in investment_returns.portfolio_data.tickers_of(customer_id)):
+            ticker_prices[customer_id] = investment_returns.get_ticker_prices_for_timeframe(
+                customer_id, "1 year", ticker_price_cache)
+    record("invest_return", best_time(
+        lambda: [investment_returns.get_invest_return(prices, customer_id)
+                 for customer_id, prices in ticker_prices.items()], repeat), max(len(ticker_prices), 1))
+    return stages
+
+
+def run_script(arguments):
+    subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, arguments[0])] + arguments[1:],
+                   check=True, stdout=subprocess.DEVNULL)
+
+
+def run_end_to_end(repeat):
+    stages = {}
+    customer_id = next(iter(investment_returns.portfolio_data))
+    ticker = investment_returns.price_data.tickers()[0]
+
+    def cold(arguments):
+        # No snapshots, so this includes parsing every CSV
+        shutil.rmtree(".snapshot_cache", ignore_errors=True)
+        run_script(arguments)
+
+    for name, arguments in [
+        ("returns_cli", ["returns.py", ticker, "1 year"]),
+        ("investment_cli", ["investment_returns.py", customer_id, "1 year"]),
+    ]:
+        stages[f"{name}_cold"] = {"seconds": round(best_time(lambda: cold(arguments), repeat), 6), "operations": 1}
+        stages[f"{name}_warm"] = {"seconds": round(best_time(lambda: run_script(arguments), repeat), 6),
+                                  "operations": 1}
+    batch = ["investment_returns.py", "--all", "--output", os.devnull]
+    stages["batch_all_warm"] = {"seconds": round(best_time(lambda: run_script(batch), repeat), 6),
+                                "operations": len(investment_returns.portfolio_data) * len(TIMEFRAMES)}
+    return stages
+
+
+def compare_to_baseline(stages, baseline, tolerance):
+    # Stage name to (seconds, baseline seconds, flagged)
+    comparison = {}
+    for name, stage in stages.items():
+        previous = baseline["stages"].get(name)
+        if previous is None:
+            continue
+        slower = stage["seconds"] - previous["seconds"]
+        flagged = stage["seconds"] > previous["seconds"] * (1 + tolerance) and slower > NOISE_SECONDS
+        comparison[name] = (stage["seconds"], previous["seconds"], flagged)
+    return comparison
+
+
+def run_suite(args):
+    config = dataset_config(args)
+    generate_dataset(args)
+
+    output_path = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    save_baseline_path = os.path.abspath(args.save_baseline) if args.save_baseline else None
+    previous_directory = os.getcwd()
+    os.chdir(args.data_dir)
+    try:
+        # Scripts print and exit for missing periods, that's part of the timing not an error
+        with contextlib.redirect_stdout(io.StringIO()):
+            stages = run_stages(args.repeat, args.seed)
+        if not args.skip_end_to_end:
+            stages.update(run_end_to_end(args.repeat))
+    finally:
+        os.chdir(previous_directory)
+
+    results = {
+        "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "numpy": np.__version__ if np is not None else None,
+        "config": config,
+        "stages": stages,
+    }
+    for path in filter(None, [output_path, save_baseline_path]):
+        with open(path, "w", encoding="utf-8") as results_file:
+            json.dump(results, results_file, indent=2)
+
+    comparison = {}
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline["config"] != config:
+            print("Baseline was recorded with a different dataset, comparing anyway")
+        if baseline.get("numpy") != results["numpy"]:
+            # Without NumPy prices load through the csv reader, so stage timings aren't like for like
+            baseline_numpy, run_numpy = (f"NumPy {version}" if version else "no NumPy"
+                                         for version in (baseline.get("numpy"), results["numpy"]))
+            print(f"Baseline was recorded with {baseline_numpy}, this run has {run_numpy}, comparing anyway")
+        comparison = compare_to_baseline(stages, baseline, args.tolerance)
+
+    for name, stage in stages.items():
+        line = f"{name:<26} {stage['seconds']:>10.4f}s"
+        if name in comparison:
+            seconds, previous, flagged = comparison[name]
+            line += f"  baseline {previous:.4f}s ({(seconds / previous - 1) * 100 if previous else 0:+.1f}%)"
+            if flagged:
+                line += "  REGRESSION"
+        print(line)
+    if any(flagged for _, _, flagged in comparison.values()):
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Price layout, ingestion and return calculation benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    dataset = argparse.ArgumentParser(add_help=False)
+    dataset.add_argument("--data-dir", default="bench_data", help="Generated dataset, reused while the options match")
+    dataset.add_argument("--seed", type=int, default=1)
+
+    prices = commands.add_parser("prices", parents=[dataset], help="Compare dict and PriceStore layouts")
+    prices.add_argument("--tickers", type=int, default=4000)
+    prices.add_argument("--years", type=int, default=10)
+
+    ingest = commands.add_parser("ingest", parents=[dataset], help="Compare DictReader and streaming ingestion")
+    ingest.add_argument("--tickers", type=int, default=4000)
+    ingest.add_argument("--years", type=int, default=10)
+    ingest.add_argument("--portfolios", help="Portfolio export to compare readers on as well")
+
+    suite = commands.add_parser("suite", parents=[dataset], help="Time each load, lookup and return stage against a baseline")
+    suite.add_argument("--tickers", type=int, default=500)
+    suite.add_argument("--years", type=int, default=5)
+    suite.add_argument("--split-rate", type=float, default=0.05, help="Fraction of tickers with a split")
+    suite.add_argument("--change-rate", type=float, default=0.02, help="Fraction of tickers with a ticker change")
+    suite.add_argument("--customers", type=int, default=5000)
+    suite.add_argument("--lots-per-customer", type=int, default=5)
+    suite.add_argument("--repeat", type=int, default=3, help="Runs per stage, the fastest is kept")
+    suite.add_argument("--skip-end-to-end", action="store_true", help="Don't time the scripts as subprocesses")
+    suite.add_argument("--output", default="bench_results.json")
+    suite.add_argument("--baseline", help="Results file to flag regressions against")
+    suite.add_argument("--save-baseline", help="Also write the results here as the new baseline")
+    suite.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging (0.2 = 20%%)")
+
+    ingest_one = commands.add_parser("ingest-one", help="Measure a single reader (internal)")
+    ingest_one.add_argument("reader", choices=list(INGEST_READERS))
+    ingest_one.add_argument("path")
+
+    layout = commands.add_parser("layout", help="Measure a single layout (internal)")
+    layout.add_argument("layout", choices=["dict", "store"])
+    layout.add_argument("path")
+
+    args = parser.parse_args()
+    if args.command == "layout":
+        print(json.dumps(bench_layout(args.layout, args.path)))
+        return
+
+    if args.command == "ingest-one":
+        print(json.dumps(bench_ingest(args.reader, args.path)))
+        return
+
+    if args.command == "suite":
+        run_suite(args)
+        return
+
+    path = generate_dataset(args)
+    if args.command == "ingest":
+        results = compare_ingest(path, args.portfolios)
+    else:
+        results = compare_price_layouts(path)
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+Read-only view of ticker changes and splits over a price store
+Built once per set of loaded data: ticker changes are compiled into
+instruments, each chain of renames (A to B to C) being one instrument named by
+its current ticker with one merged close series shared by all its tickers, so
+a query on any of them is a dict lookup and a bisect however long the chain,
+and split adjustments are derived per lot instead of written back into the
+portfolio
+Splits are parsed once into cumulative factor tables, so the adjustment
+between any two dates is two bisects and a division
+Nothing in the underlying data is modified, so repeated and concurrent
+queries over the same view always see the same numbers
+When data is replaced, changed_tickers finds the tickers that differ between
+two views and carry_caches moves the results that don't depend on them over
+to the new view, and refresh_prices merges just the instruments of tickers
+that had rows appended in place
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from price_store import PriceStore
+from result_cache import LRUCache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_view = None
+
+
+class CorporateActions:
+
+    def __init__(self, price_data, splits_data, ticker_changes_data):
+        self.price_data = price_data
+        self.splits_data = splits_data
+        self.ticker_changes_data = ticker_changes_data
+        # Current ticker of each instrument to its tickers in the order they became active
+        self.instruments = compile_instruments(ticker_changes_data)
+        self.active_from = active_from(ticker_changes_data)
+        # Any ticker with a ticker change to its instrument's current ticker
+        self.canonical = {}
+        self.aliases = {}
+        for current_ticker, tickers in self.instruments.items():
+            for ticker in tickers:
+                self.canonical[ticker] = current_ticker
+                self.aliases[ticker] = tuple(aka_ticker for aka_ticker in tickers if aka_ticker != ticker)
+
+        # One series per instrument, each ticker's closes while it was the
+        # active one, read under every one of its tickers without a copy
+        self.merged_prices = PriceStore()
+        for current_ticker in self.instruments:
+            self._merge(current_ticker)
+        self.merged_prices.build_calendars()
+
+        # Per ticker split dates as sorted ordinals with prefix products of the
+        # share ratios, factors[i] being the product of the first i splits
+        self.split_tables = {}
+        for ticker, splits in splits_data.items():
+            parsed = sorted(
+                (datetime.strptime(split_date_str, "%d/%m/%Y").date().toordinal(),
+                 float(to_quantity) / float(from_quantity))
+                for split_date_str, (from_quantity, to_quantity) in splits.items()
+            )
+            factors = [1.0]
+            for _, ratio in parsed:
+                factors.append(factors[-1] * ratio)
+            self.split_tables[ticker] = (array("l", [split_ordinal for split_ordinal, _ in parsed]), factors)
+
+        # Result caches live and die with the view, so replaced data never serves stale prices
+        self.caches = {}
+
+    def _merge(self, current_ticker):
+        # Each ticker's closes from the day it became active until the next one did
+        tickers = self.instruments[current_ticker]
+        for index, ticker in enumerate(tickers):
+            if ticker not in self.price_data:
+                continue
+            first_day = self.active_from[ticker]
+            # Tickers active from the same day overlap, the later one wins on shared dates
+            next_days = [self.active_from[later] for later in tickers[index + 1:] if self.active_from[later] > first_day]
+            dates = self.price_data.dates(ticker)
+            start = bisect_left(dates, first_day)
+            end = bisect_left(dates, next_days[0]) if next_days else len(dates)
+            if start < end:
+                # Copied by value, a mapped store's dates are 8 byte memoryviews whatever the size of C long
+                self.merged_prices.add_series(current_ticker, array("l", dates[start:end]),
+                                              array("d", self.price_data.closes(ticker)[start:end]), True)
+        if current_ticker in self.merged_prices:
+            for ticker in tickers[:-1]:
+                self.merged_prices.add_alias(ticker, current_ticker)
+
+    def refresh_tickers(self, tickers):
+        # Merges the instruments of tickers again after rows were added to them, the others keep their series
+        for current_ticker in {self.canonical[ticker] for ticker in tickers if ticker in self.canonical}:
+            for ticker in self.instruments[current_ticker]:
+                self.merged_prices.remove(ticker)
+            self._merge(current_ticker)
+        self.merged_prices.build_calendars()
+
+    def cache(self, name, maxsize):
+        if name not in self.caches:
+            self.caches[name] = LRUCache(maxsize)
+        return self.caches[name]
+
+    def aka_tickers(self, ticker):
+        # Ticker changes first then the ticker itself, the order handle_ticker_change used
+        return list(self.aliases.get(ticker, ())) + [ticker]
+
+    def dependent_tickers(self, tickers):
+        # tickers and every ticker whose results use one of them through a ticker change
+        dependent = set(tickers)
+        for ticker in tickers:
+            if ticker in self.canonical:
+                dependent.update(self.instruments[self.canonical[ticker]])
+        return dependent
+
+    def prices_for(self, ticker):
+        if ticker in self.merged_prices:
+            return self.merged_prices
+        return self.price_data
+
+    def close_on_or_before(self, ticker, day):
+        return self.prices_for(ticker).close_on_or_before(ticker, day)
+
+    def closes_on_or_before(self, tickers, day):
+        # Dict of ticker to (date, close) or None, one batch per store
+        merged = [ticker for ticker in tickers if ticker in self.merged_prices]
+        plain = [ticker for ticker in tickers if ticker not in self.merged_prices]
+        closes = self.merged_prices.closes_on_or_before(merged, day) if merged else {}
+        if plain:
+            closes.update(self.price_data.closes_on_or_before(plain, day))
+        return closes
+
+    def split_factor(self, ticker, after, through, include_through=True):
+        """
+        Product of ticker's split ratios (new shares per old share) for splits
+        after the after ordinal and up to the through ordinal, found by bisect
+        include_through=False leaves out a split on the through date itself
+        """
+        table = self.split_tables.get(ticker)
+        if table is None:
+            return 1.0
+        split_ordinals, factors = table
+        first = bisect_right(split_ordinals, after)
+        last = bisect_right(split_ordinals, through) if include_through else bisect_left(split_ordinals, through)
+        if last <= first:
+            return 1.0
+        return factors[last] / factors[first]
+
+    def has_splits(self, ticker):
+        return any(aka_ticker in self.split_tables for aka_ticker in self.aka_tickers(ticker))
+
+    def split_factors(self, ticker, after_ordinals, through_ordinals, include_through=True):
+        """
+        split_factor for arrays of after and through ordinals at once, across
+        all of ticker's aliases, one searchsorted per aliased split table
+        Returns a NumPy array of the broadcast shape, needs NumPy
+        """
+        after_ordinals = np.asarray(after_ordinals, dtype=np.int64)
+        through_ordinals = np.asarray(through_ordinals, dtype=np.int64)
+        split_factors = np.ones(np.broadcast(after_ordinals, through_ordinals).shape)
+        for aka_ticker in self.aka_tickers(ticker):
+            table = self.split_tables.get(aka_ticker)
+            if table is None:
+                continue
+            split_ordinals = np.asarray(table[0], dtype=np.int64)
+            factors = np.array(table[1])
+            first = np.searchsorted(split_ordinals, after_ordinals, side="right")
+            last = np.searchsorted(split_ordinals, through_ordinals, side="right" if include_through else "left")
+            split_factors *= np.where(first < last, factors[last] / factors[np.minimum(first, last)], 1.0)
+        return split_factors
+
+    def position_split_ratio(self, ticker, purchase_date, end_date):
+        # Shares held at end_date per share bought on purchase_date, across the ticker's aliases
+        split_ratio = 1.0
+        for aka_ticker in self.aka_tickers(ticker):
+            if aka_ticker in self.split_tables:
+                split_ratio *= self.split_factor(aka_ticker, purchase_date.toordinal(), end_date.toordinal())
+        return split_ratio
+
+
+def _change_ordinal(effective_date_str):
+    return datetime.strptime(effective_date_str, "%d/%m/%Y").date().toordinal()
+
+
+def _ticker_groups(pairs):
+    # Union-find over (ticker, changed ticker) pairs, lists of tickers linked by any chain of changes
+    parent = {}
+
+    def find(ticker):
+        parent.setdefault(ticker, ticker)
+        while parent[ticker] != ticker:
+            parent[ticker] = parent[parent[ticker]]
+            ticker = parent[ticker]
+        return ticker
+
+    for ticker, changed_ticker in pairs:
+        parent[find(changed_ticker)] = find(ticker)
+    groups = {}
+    for ticker in parent:
+        groups.setdefault(find(ticker), []).append(ticker)
+    return list(groups.values())
+
+
+def linked_tickers(ticker_changes_data, tickers):
+    # tickers and every ticker linked to one of them through a chain of ticker changes
+    linked = set(tickers)
+    pairs = ((ticker, changed_ticker) for ticker, changes in ticker_changes_data.items() for _, changed_ticker in changes)
+    for group in _ticker_groups(pairs):
+        if linked.intersection(group):
+            linked.update(group)
+    return linked
+
+
+def _parse_changes(ticker_changes_data):
+    # (old ticker, new ticker, effective ordinal) per change, refusing a change listed in both directions
+    changes = [(old_ticker, new_ticker, _change_ordinal(effective_date_str))
+               for old_ticker, ticker_changes in ticker_changes_data.items()
+               for effective_date_str, new_ticker in ticker_changes]
+    listed = set(changes)
+    for old_ticker, new_ticker, effective_ordinal in changes:
+        if old_ticker == new_ticker or (new_ticker, old_ticker, effective_ordinal) in listed:
+            raise ValueError(f"Ticker change from {old_ticker} to {new_ticker} is also listed from {new_ticker} "
+                             f"to {old_ticker}, ticker changes must be listed under the old ticker")
+    return changes
+
+
+def active_from(ticker_changes_data):
+    # Ticker to the ordinal of the latest change that renames to it, -1 for the first ticker of a chain
+    first_days = {}
+    for old_ticker, new_ticker, effective_ordinal in _parse_changes(ticker_changes_data):
+        first_days.setdefault(old_ticker, -1)
+        first_days[new_ticker] = max(first_days.get(new_ticker, -1), effective_ordinal)
+    return first_days
+
+
+def compile_instruments(ticker_changes_data):
+    """
+    Current ticker to the tuple of tickers of its chain of ticker changes,
+    ordered by the effective date each became active, the current one last
+    ticker_changes_data lists each change under its old ticker, as
+    read_ticker_changes_input reads it, so the rows can be in any order
+    Raises ValueError for a change also listed the other way round
+    """
+    first_days = active_from(ticker_changes_data)
+    instruments = {}
+    pairs = ((old_ticker, new_ticker) for old_ticker, ticker_changes in ticker_changes_data.items()
+             for _, new_ticker in ticker_changes)
+    for group in _ticker_groups(pairs):
+        tickers = tuple(sorted(group, key=lambda ticker: (first_days[ticker], ticker)))
+        instruments[tickers[-1]] = tickers
+    return instruments
+
+
+def view(price_data, splits_data, ticker_changes_data):
+    # One view per loaded dataset, rebuilt when any of the globals is replaced
+    global _view
+    if (_view is None or _view.price_data is not price_data or _view.splits_data is not splits_data
+            or _view.ticker_changes_data is not ticker_changes_data):
+        _view = CorporateActions(price_data, splits_data, ticker_changes_data)
+    return _view
+
+
+def refresh_prices(price_data, first_ordinal, tickers):
+    """
+    Called after rows from first_ordinal on were added to tickers of
+    price_data in place and its calendars were built
+    Updates the current view's merged series of just those tickers'
+    instruments, dropping cached results keyed (ticker, start ordinal, end
+    ordinal) that end on or after the new rows
+    """
+    if _view is None or _view.price_data is not price_data:
+        return
+    _view.refresh_tickers(tickers)
+    for cache in _view.caches.values():
+        cache.discard_where(lambda key: key[2] >= first_ordinal)
+
+
+def rebuild_view():
+    # A fresh view over the current view's data after it was changed in place, (old view, new view)
+    global _view
+    old_view = _view
+    _view = CorporateActions(old_view.price_data, old_view.splits_data, old_view.ticker_changes_data)
+    return old_view, _view
+
+
+def _same_series(old_prices, new_prices, ticker):
+    # Compared as bytes, a mapped store's series are memoryviews rather than arrays
+    return (ticker in old_prices and ticker in new_prices
+            and memoryview(old_prices.dates(ticker)).tobytes() == memoryview(new_prices.dates(ticker)).tobytes()
+            and memoryview(old_prices.closes(ticker)).tobytes() == memoryview(new_prices.closes(ticker)).tobytes())
+
+
+def changed_tickers(old_view, new_view):
+    # Tickers whose prices, splits or ticker changes differ between the two views' data
+    changed = set()
+    if new_view.price_data is not old_view.price_data:
+        for ticker in set(old_view.price_data.tickers()).union(new_view.price_data.tickers()):
+            if not _same_series(old_view.price_data, new_view.price_data, ticker):
+                changed.add(ticker)
+    for old_data, new_data in ((old_view.splits_data, new_view.splits_data),
+                               (old_view.ticker_changes_data, new_view.ticker_changes_data)):
+        if new_data is not old_data:
+            changed.update(ticker for ticker in set(old_data).union(new_data)
+                           if old_data.get(ticker) != new_data.get(ticker))
+    return changed
+
+
+def carry_caches(old_view, new_view, keep):
+    # Hands old_view's result caches over to new_view, less the entries keep(cache name, key) rejects
+    for name, cache in old_view.caches.items():
+        cache.discard_where(lambda key: not keep(name, key))
+        new_view.caches[name] = cache
@@ -0,0 +1,99 @@
+"""
+Daily portfolio value of every customer over a timeframe, for statements
+Each holding's split-adjusted share count is a step function of the trading
+days, stepping up on the days its lots are bought; times the ticker's close
+series (merged across ticker changes) and summed per customer it gives the
+value on the period start, every trading day and the period end, the same
+numbers get_invest_return has for the two endpoints
+Like get_invest_return, the start value holds the lots bought by each
+ticker's last close on or before the period start; lots bought after it are
+counted from the first trading day after the start
+Customers are valued and written a chunk at a time, so memory beyond the
+lots themselves stays bounded however many customers there are. Needs NumPy
+Usage: python daily_values.py --all --timeframe '1 year' --output values.csv
+       python daily_values.py --customers-file customers.txt --timeframe '6 months'
+"""
+import argparse
+import csv
+import sys
+from datetime import date
+
+import numpy as np
+
+import investment_returns
+from periods import TIMEFRAMES, resolve_period
+from return_methods import adjusted_closes, base_shares, iter_daily_values, period_days, start_close_days
+from vector_returns import LotArrays
+
+
+def daily_value_chunks(engine, lots, timeframe):
+    """
+    The period's day ordinals and an iterator of (customer IDs, values,
+    missing) per chunk of customers: a customers x days value matrix and
+    whether each customer holds a ticker without a close by the period start
+    Day 0 holds the lots bought by their ticker's resolved start close
+    """
+    actions = engine.get_corporate_actions()
+    start_date, end_date = resolve_period(timeframe)
+    days = period_days(actions, lots.tickers, start_date.toordinal(), end_date.toordinal())
+    closes, ticker_missing = adjusted_closes(actions, lots, days)
+    shares = base_shares(actions, lots)
+    start_days = start_close_days(actions, lots, start_date.toordinal())
+    customer_missing = np.bincount(lots.customer, weights=ticker_missing[lots.ticker],
+                                   minlength=len(lots.customer_ids)) > 0
+    chunks = ((lots.customer_ids[first_customer:end_customer], values, customer_missing[first_customer:end_customer])
+              for first_customer, end_customer, values, _ in iter_daily_values(lots, closes, days, shares, start_days))
+    return days, chunks
+
+
+def write_daily_values(engine, lots, timeframe, output_file):
+    # CSV line per customer with a value to the cent per day, or no values and an error when prices are missing
+    days, chunks = daily_value_chunks(engine, lots, timeframe)
+    date_strs = [date.fromordinal(day_ordinal).isoformat() for day_ordinal in days.tolist()]
+    ticker_price_cache = {}
+    writer = csv.writer(output_file)
+    writer.writerow(["customer_id"] + date_strs + ["error"])
+    # Formatting a whole row at once is several times quicker than the csv module per value
+    row_format = "%s," + ",".join(["%.2f"] * len(date_strs)) + ",\r\n"
+    rows = 0
+    for customer_ids, values, missing in chunks:
+        for customer_id, customer_values, customer_missing in zip(customer_ids, values.tolist(), missing.tolist()):
+            if customer_missing:
+                ticker = engine.missing_ticker(customer_id, timeframe, ticker_price_cache)
+                writer.writerow([customer_id] + [""] * len(date_strs) + [f"requested period for {ticker} not found"])
+            else:
+                output_file.write(row_format % (customer_id, *customer_values))
+        rows += len(customer_ids)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Daily portfolio value of every customer over a timeframe")
+    customers = parser.add_mutually_exclusive_group(required=True)
+    customers.add_argument("--all", action="store_true", help="Every customer in portfolios.csv")
+    customers.add_argument("--customers-file", help="File with one customer ID per line")
+    parser.add_argument("--timeframe", choices=list(TIMEFRAMES), default="1 year")
+    parser.add_argument("--output", help="Output file (default: stdout)")
+    args = parser.parse_args()
+
+    if args.all:
+        investment_returns.read_inputs()
+    else:
+        # Only the customers asked for are loaded and valued
+        customer_ids = investment_returns.read_customers_file(args.customers_file)
+        investment_returns.read_inputs(customer_ids=set(customer_ids))
+        unknown = [customer_id for customer_id in customer_ids if customer_id not in investment_returns.portfolio_data]
+        if unknown:
+            print(f"Unknown customer {unknown[0]}")
+            sys.exit(1)
+    lots = LotArrays(investment_returns.portfolio_data)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as output_file:
+            write_daily_values(investment_returns, lots, args.timeframe, output_file)
+    else:
+        write_daily_values(investment_returns, lots, args.timeframe, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,12 +6,35 @@ So only the actual change of the tickers price is what is shown
 Splits and ticker changes are considered
 Takes customer ID and timeframe as input
 """
+import argparse
 import csv
+import json
 import sys
 from collections import defaultdict
-from datetime import date, datetime, timedelta
-
-TIMEFRAMES = {"1 day": 1, "5 days": 5, "6 months": 182, "1 year": 365}
+from datetime import date, datetime
+from functools import partial
+
+import corporate_actions
+import parallel_returns
+import timings
+from loader import load_sources
+from mapped_prices import open_mapped_prices
+from periods import END_DATE, TIMEFRAMES, describe_period, parse_period, resolve_period
+from portfolio_store import read_portfolio_store
+from price_store import append_price_rows, read_price_store
+
+# Resolved ticker prices kept per (ticker, start, end) when no cache is passed in
+PRICE_CACHE_SIZE = 4096
+# Customer results kept per (customer ID, start, end) by get_cached_return
+RESULT_CACHE_SIZE = 65536
+
+# Functions timed by --timings
+TIMED_STAGES = ["open_mapped_prices", "load_sources", "read_price_input", "read_splits_input",
+                "read_ticker_changes_input", "read_portfolio_input", "get_corporate_actions", "handle_ticker_change",
+                "get_ticker_prices", "handle_split_price", "handle_split_customer_position",
+                "get_ticker_prices_for_timeframe", "get_invest_return"]
+# Date resolution, every query resolves the period dates through the view
+TIMED_METHODS = [(corporate_actions.CorporateActions, ["closes_on_or_before"])]
 
 price_data = None
 splits_data = None
@@ -19,67 +42,21 @@ ticker_changes_data = None
 portfolio_data = None
 
 
-def merge_dates(left, right):
-    sorted_dates = []
-    i = 0
-    j = 0
-    while i < len(left) and j < len(right):
-        left_date = datetime.strptime(left[i], "%Y-%m-%d").date()
-        right_date = datetime.strptime(right[j], "%Y-%m-%d").date()
-        if left_date < right_date:
-            sorted_dates.append(left[i])
-            i += 1
-        else:
-            sorted_dates.append(right[j])
-            j += 1
-
-    sorted_dates.extend(left[i:])
-    sorted_dates.extend(right[j:])
-    return sorted_dates
-
-
 def sort_dates(dates):
-    # Merge sort!
-    if len(dates) <= 1:
-        return dates
-
-    middle = len(dates) // 2
-    left = sort_dates(dates[:middle])
-    right = sort_dates(dates[middle:])
-
-    return merge_dates(left, right)
+    # Parse each date once and let sorted do the work
+    return sorted(dates, key=lambda date_str: datetime.strptime(date_str, "%Y-%m-%d"))
 
 
 def get_last_close_date(ticker, start_date):
-    # Dict is already sorted from input but sorting for case it isn't
-    # Binary search to find it!
-    all_dates = sort_dates(list(price_data[ticker].keys()))
-    left = 0
-    right = len(all_dates) - 1
-
-    last_close_date = None
-    while left <= right:
-        middle = left + ((right - left) // 2)
-        date_to_check = datetime.strptime(all_dates[middle], "%Y-%m-%d").date()
-        if date_to_check > start_date:
-            right = middle - 1
-        elif date_to_check < start_date:
-            last_close_date = date_to_check
-            left = middle + 1
-        else:
-            return None
-    return last_close_date
+    # The store's shared calendar resolves start_date once for every ticker
+    return get_corporate_actions().prices_for(ticker).last_close_before(ticker, start_date)
 
 
-def output_result(portfolio_return):
+def calc_investment_return(portfolio_return):
     start_portfolio_total = portfolio_return["start_total"]
     current_portfolio_total = portfolio_return["current_total"]
     contribution_cost_total = portfolio_return["contribution_total"]
 
-    print(f"Start position: ${start_portfolio_total:.2f}")
-    print(f"Current position: ${current_portfolio_total:.2f}")
-    print(f"Contributions made during period: ${contribution_cost_total:.2f}")
-
     # Handle customer with $0 at start of period
     if start_portfolio_total == 0:
         if contribution_cost_total > 0:
@@ -91,7 +68,15 @@ def output_result(portfolio_return):
     else:
         investment_return_dollar = current_portfolio_total - start_portfolio_total - contribution_cost_total
         investment_return_percentage = (investment_return_dollar / start_portfolio_total) * 100
+    return investment_return_dollar, investment_return_percentage
 
+
+def output_result(portfolio_return):
+    print(f"Start position: ${portfolio_return['start_total']:.2f}")
+    print(f"Current position: ${portfolio_return['current_total']:.2f}")
+    print(f"Contributions made during period: ${portfolio_return['contribution_total']:.2f}")
+
+    investment_return_dollar, investment_return_percentage = calc_investment_return(portfolio_return)
     sign = "+" if investment_return_dollar > 0 else ""
     print(f"Overall return: ${sign}{investment_return_dollar:.2f} ({sign}{investment_return_percentage:.2f}%)")
 
@@ -101,28 +86,38 @@ def get_invest_return(ticker_prices, customer_id):
     start_portfolio_total = 0
     current_portfolio_total = 0
 
-    for ticker, purchases in portfolio_data[customer_id].items():
+    # Lots are already parsed, dates compare as day ordinals
+    purchase_dates = portfolio_data.purchase_dates
+    lot_shares = portfolio_data.shares
+    lot_cost_basis = portfolio_data.cost_basis
+    for ticker, first_lot, end_lot in portfolio_data.holdings(customer_id):
         end_price = ticker_prices[ticker]["end_price"]
         start_price = ticker_prices[ticker]["start_price"]
         start_date = ticker_prices[ticker]["start_date"]
         end_date = ticker_prices[ticker]["end_date"]
-
-        for purchase in purchases:
-            purchase_date = datetime.strptime(purchase["purchase_date"], "%Y-%m-%d").date()
-            shares_qty = purchase["shares_qty"]
-            cost_basis = purchase["cost_basis"]
+        start_ordinal = start_date.toordinal()
+        end_ordinal = end_date.toordinal()
+
+        for lot in range(first_lot, end_lot):
+            purchase_ordinal = purchase_dates[lot]
+            # Lots bought after the period weren't held in it
+            if purchase_ordinal > end_ordinal:
+                continue
+            # Splits after purchase change the share count but not the total cost
+            split_ratio = handle_split_customer_position(ticker, date.fromordinal(purchase_ordinal), end_date)
+            shares_qty = lot_shares[lot] * split_ratio
 
             # Did the customer own the shares before or on the period start date
-            if purchase_date <= start_date:
-                start_value = start_price * float(shares_qty)
+            if purchase_ordinal <= start_ordinal:
+                start_value = start_price * shares_qty
                 start_portfolio_total += start_value
             # Did the customer make any contributions during this period to exclude from return
-            elif start_date < purchase_date <= end_date:
-                contribution_cost = float(cost_basis) * float(shares_qty)
+            elif start_ordinal < purchase_ordinal <= end_ordinal:
+                contribution_cost = lot_cost_basis[lot] * lot_shares[lot]
                 contribution_cost_total += contribution_cost
 
             # Add up current value at end of period
-            current_value = end_price * float(shares_qty)
+            current_value = end_price * shares_qty
             current_portfolio_total += current_value
 
     return {
@@ -132,77 +127,100 @@ def get_invest_return(ticker_prices, customer_id):
     }
 
 
-def handle_ticker_change(ticker):
-    changed_tickers = []
-    for _, changed_ticker in ticker_changes_data[ticker]:
-        price_data[ticker].update(price_data[changed_ticker])
-        changed_tickers.append(changed_ticker)
-    return changed_tickers
+def get_corporate_actions():
+    # Ticker changes and splits resolved once per loaded dataset
+    return corporate_actions.view(price_data, splits_data, ticker_changes_data)
+
+
+def get_price_cache():
+    return get_corporate_actions().cache("investment_returns", PRICE_CACHE_SIZE)
+
+
+def get_result_cache():
+    return get_corporate_actions().cache("investment_results", RESULT_CACHE_SIZE)
 
 
-def handle_split_customer_position(ticker, start_date, end_date, customer_portfolio):
-    purchases = customer_portfolio[ticker]
-    splits = splits_data[ticker]
+def stale_entries(old_actions, new_actions, tickers):
+    """
+    keep function for corporate_actions.carry_caches after the data of
+    tickers changed, and the customers whose results it drops
+    Prices of every ticker depending on them, before or after any change to
+    the ticker changes, go along with the results of the customers holding one
+    """
+    dependent = old_actions.dependent_tickers(tickers) | new_actions.dependent_tickers(tickers)
+    customers = set()
+    for ticker in dependent:
+        customers.update(portfolio_data.customers_holding(ticker))
 
-    for purchase in purchases:
-        for split_date_str, (from_quantity, to_quantity) in splits.items():
-            split_date = datetime.strptime(split_date_str, "%d/%m/%Y").date()
-            purchase_date = datetime.strptime(purchase["purchase_date"], "%Y-%m-%d").date()
-            # Did a split occur after purchase date
-            if purchase_date < split_date <= end_date:
-                split_ratio = float(to_quantity) / float(from_quantity)
-                shares_qty = float(purchase["shares_qty"])
-                cost_basis = float(purchase["cost_basis"])
+    def keep(name, key):
+        return key[0] not in (customers if name == "investment_results" else dependent)
+    return keep, customers
 
-                purchase["shares_qty"] = str(shares_qty * split_ratio)
-                purchase["cost_basis"] = str(cost_basis / split_ratio)
+
+def invalidate_tickers(tickers):
+    """
+    Call after the prices, splits or ticker changes of tickers were corrected
+    in place: rebuilds the corporate actions view, keeping every cached price
+    and customer result that doesn't depend on them
+    Returns the customers whose results will be recomputed
+    """
+    get_corporate_actions()
+    old_actions, new_actions = corporate_actions.rebuild_view()
+    keep, customers = stale_entries(old_actions, new_actions, tickers)
+    corporate_actions.carry_caches(old_actions, new_actions, keep)
+    return customers
+
+
+def handle_ticker_change(ticker):
+    # Merged price history is precomputed, this only names the other tickers
+    return get_corporate_actions().aka_tickers(ticker)[:-1]
+
+
+def handle_split_customer_position(ticker, purchase_date, end_date):
+    # Split ratio for a lot, derived rather than written back into portfolio_data
+    return get_corporate_actions().position_split_ratio(ticker, purchase_date, end_date)
 
 
 def handle_split_price(ticker, start_date, end_date, price):
-    splits = splits_data[ticker]
-    adjusted_price = price
-    for split_date_str, split_ratio in splits.items():
-        split_date = datetime.strptime(split_date_str, "%d/%m/%Y").date()
-        # Only action splits that have occurred within timeframe
-        if start_date < split_date <= end_date:
-            from_quantity, to_quantity = split_ratio
-            adjusted_price *= float(from_quantity) / float(to_quantity)
-    return adjusted_price
-
-
-def get_ticker_prices_for_timeframe(customer_id, timeframe):
-    end_date = date(2024, 12, 31)
-    start_date = end_date - timedelta(days=TIMEFRAMES[timeframe])
-    customer_data = portfolio_data[customer_id]
+    # Only action splits that have occurred within timeframe
+    split_factor = get_corporate_actions().split_factor(ticker, start_date.toordinal(), end_date.toordinal())
+    return price / split_factor
+
+
+def get_ticker_price(ticker, timeframe):
+    # Ticker level prices for the period, the same for every customer holding ticker
+    # timeframe is a TIMEFRAMES name or a (start_date, end_date) pair
+    return get_ticker_prices([ticker], timeframe)[ticker]
+
+
+def get_ticker_prices(tickers, timeframe):
+    # get_ticker_price for many tickers, each period date is resolved once for all of them
+    start_date, end_date = resolve_period(timeframe)
+    # When date is a weekend or holiday, use the last close before it
+    actions = get_corporate_actions()
+    start_closes = actions.closes_on_or_before(tickers, start_date)
+    end_closes = actions.closes_on_or_before(tickers, end_date)
 
     ticker_prices = {}
-    for ticker in customer_data:
+    for ticker in tickers:
+        start_close = start_closes[ticker]
+        end_close = end_closes[ticker]
+        if not start_close or not end_close:
+            ticker_prices[ticker] = None
+            continue
+        ticker_start_date, start_close_price = start_close
+        _, end_close_price = end_close
+
         aka_tickers = []
-        ticker_start_date = start_date
         # Handle potential ticker changes
         if ticker in ticker_changes_data:
             aka_tickers = handle_ticker_change(ticker)
         aka_tickers.append(ticker)
-        # When date is a weekend or holiday, find last close price
-        if ticker_start_date.strftime("%Y-%m-%d") not in price_data[ticker]:
-            ticker_start_date = get_last_close_date(ticker, ticker_start_date)
-            if not ticker_start_date:
-                print(f"Requested period for {ticker} not found")
-                sys.exit(1)
-
-        end_date_str = end_date.strftime("%Y-%m-%d")
-        start_date_str = ticker_start_date.strftime("%Y-%m-%d")
-
-        end_close_price = float(price_data[ticker][end_date_str])
-        start_close_price = float(price_data[ticker][start_date_str])
-
         # Handle split if one has occurred during period
         for aka_ticker in aka_tickers:
             if aka_ticker in splits_data:
                 start_close_price = handle_split_price(aka_ticker, ticker_start_date,
-                                                            end_date, start_close_price)
-                if aka_ticker in customer_data:
-                    handle_split_customer_position(aka_ticker, ticker_start_date, end_date, customer_data)
+                                                       end_date, start_close_price)
 
         ticker_prices[ticker] = {
             "start_price": start_close_price,
@@ -210,10 +228,52 @@ def get_ticker_prices_for_timeframe(customer_id, timeframe):
             "start_date": ticker_start_date,
             "end_date": end_date,
         }
+    return ticker_prices
+
+
+def get_cached_ticker_price(ticker, timeframe, ticker_price_cache=None):
+    return get_cached_ticker_prices([ticker], timeframe, ticker_price_cache)[ticker]
+
 
+def get_cached_ticker_prices(tickers, timeframe, ticker_price_cache=None):
+    # Keyed on the dates so a named timeframe and the same explicit range share an entry
+    if ticker_price_cache is None:
+        ticker_price_cache = get_price_cache()
+    start_date, end_date = resolve_period(timeframe)
+    start_ordinal = start_date.toordinal()
+    end_ordinal = end_date.toordinal()
+    ticker_prices = {}
+    missing = []
+    for ticker in tickers:
+        ticker_price = ticker_price_cache.get((ticker, start_ordinal, end_ordinal), False)
+        if ticker_price is False:
+            missing.append(ticker)
+        else:
+            ticker_prices[ticker] = ticker_price
+    if missing:
+        for ticker, ticker_price in get_ticker_prices(missing, timeframe).items():
+            ticker_price_cache[(ticker, start_ordinal, end_ordinal)] = ticker_price
+            ticker_prices[ticker] = ticker_price
     return ticker_prices
 
 
+def get_ticker_prices_for_timeframe(customer_id, timeframe, ticker_price_cache=None):
+    ticker_prices = get_cached_ticker_prices(portfolio_data.tickers_of(customer_id), timeframe, ticker_price_cache)
+    for ticker, ticker_price in ticker_prices.items():
+        if ticker_price is None:
+            print(f"Requested period for {ticker} not found")
+            sys.exit(1)
+
+    return ticker_prices
+
+
+def missing_ticker(customer_id, timeframe, ticker_price_cache=None):
+    # First of the customer's tickers with no prices for timeframe, None if none are missing
+    tickers = portfolio_data.tickers_of(customer_id)
+    ticker_prices = get_cached_ticker_prices(tickers, timeframe, ticker_price_cache)
+    return next((ticker for ticker in tickers if ticker_prices[ticker] is None), None)
+
+
 def read_ticker_changes_input():
     data = defaultdict(list)
     with open("ticker_changes.csv", encoding="utf-8") as ticker_changes_file:
@@ -223,8 +283,9 @@ def read_ticker_changes_input():
             effective_date = row["effective_date"]
             new_ticker = row["new_ticker"]
 
+            # Changes are listed under the old ticker, the new one is a key so it's known to have a change
             data[old_ticker].append([effective_date, new_ticker])
-            data[new_ticker].append([effective_date, old_ticker])
+            data.setdefault(new_ticker, [])
         return data
 
 
@@ -243,57 +304,202 @@ def read_splits_input():
 
 
 def read_price_input():
-    data = defaultdict(dict)
-    with open("prices.csv", encoding="utf-8") as price_file:
-        reader = csv.DictReader(price_file)
-        for row in reader:
-            ticker = row["ticker"]
-            close_date = row["date"]
-            close_price = row["close_price"]
+    return read_price_store("prices.csv")
 
-            data[ticker][close_date] = close_price
-        return data
 
+def read_portfolio_input(path="portfolios.csv", customer_ids=None):
+    return read_portfolio_store(path, customer_ids)
 
-def read_portfolio_input():
-    data = defaultdict(lambda: defaultdict(list))
-    with open("portfolios.csv", encoding="utf-8") as portfolio_file:
-        reader = csv.DictReader(portfolio_file)
-        for row in reader:
-            customer_id = row["customer_id"]
-            ticker = row["ticker"]
-            purchase_date = row["purchase_date"]
-            shares_qty = row["shares"]
-            cost_basis = row["cost_basis"]
 
-            data[customer_id][ticker].append({
-                "purchase_date": purchase_date,
-                "shares_qty": shares_qty,
-                "cost_basis": cost_basis
-            })
+def evaluate_customer(customer_id, timeframe, ticker_price_cache):
+    if customer_id not in portfolio_data:
+        return {"customer_id": customer_id, "timeframe": timeframe, "error": "unknown customer"}
+
+    ticker_prices = get_cached_ticker_prices(portfolio_data.tickers_of(customer_id), timeframe, ticker_price_cache)
+    for ticker, ticker_price in ticker_prices.items():
+        if ticker_price is None:
+            return {"customer_id": customer_id, "timeframe": timeframe,
+                    "error": f"requested period for {ticker} not found"}
+
+    return_total = get_invest_return(ticker_prices, customer_id)
+
+    return_dollar, return_percentage = calc_investment_return(return_total)
+    return {
+        "customer_id": customer_id,
+        "timeframe": timeframe,
+        "start_total": float(return_total["start_total"]),
+        "current_total": float(return_total["current_total"]),
+        "contribution_total": float(return_total["contribution_total"]),
+        "return_dollar": float(return_dollar),
+        "return_percentage": float(return_percentage),
+        "error": "",
+    }
 
-        return data
 
+def get_cached_return(customer_id, timeframe):
+    # evaluate_customer through the result cache, keyed on the dates like the price caches
+    start_date, end_date = resolve_period(timeframe)
+    key = (customer_id, start_date.toordinal(), end_date.toordinal())
+    result_cache = get_result_cache()
+    result = result_cache.get(key)
+    if result is None:
+        result = result_cache[key] = evaluate_customer(customer_id, timeframe, None)
+    return dict(result, timeframe=timeframe)
+
+
+def iter_batch_results(customer_ids, timeframes, ticker_price_cache=None):
+    # Ticker prices are shared by every customer holding the ticker
+    if ticker_price_cache is None:
+        ticker_price_cache = {}
+    for customer_id in customer_ids:
+        for timeframe in timeframes:
+            yield evaluate_customer(customer_id, timeframe, ticker_price_cache)
+
+
+BATCH_FIELDS = ["customer_id", "timeframe", "start_total", "current_total", "contribution_total",
+                "return_dollar", "return_percentage", "error"]
+
+
+def write_batch_results(results, output_file, output_format):
+    if output_format == "jsonl":
+        for result in results:
+            output_file.write(json.dumps(result) + "\n")
+        return
+    writer = csv.DictWriter(output_file, fieldnames=BATCH_FIELDS, restval="")
+    writer.writeheader()
+    for result in results:
+        writer.writerow(result)
+
+
+def read_customers_file(path):
+    with open(path, encoding="utf-8") as customers_file:
+        return [line.strip() for line in customers_file if line.strip()]
+
+
+def parse_batch_arguments(argv):
+    parser = argparse.ArgumentParser(
+        prog="investment_returns.py",
+        description="Investment returns for many customers and timeframes in one run",
+    )
+    customers = parser.add_mutually_exclusive_group(required=True)
+    customers.add_argument("--all", action="store_true", help="Every customer in portfolios.csv")
+    customers.add_argument("--customers-file", help="File with one customer ID per line")
+    parser.add_argument("--timeframe", action="append", choices=list(TIMEFRAMES), dest="timeframes",
+                        help="Timeframe to calculate, repeatable (default: all)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv", dest="output_format")
+    parser.add_argument("--output", help="Output file (default: stdout)")
+    parser.add_argument("--engine", choices=["scalar", "vector"], default="scalar",
+                        help="vector evaluates every customer at once with NumPy")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes, 0 for one per CPU (default: 1)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Customers per worker task")
+    parser.add_argument("--no-cache", action="store_true", help="Parse the CSVs instead of using snapshots")
+    return parser.parse_args(argv)
+
+
+def run_batch(argv):
+    args = parse_batch_arguments(argv)
+    if args.all:
+        read_inputs(use_cache=not args.no_cache)
+        customer_ids = list(portfolio_data)
+    else:
+        customer_ids = read_customers_file(args.customers_file)
+        # Without snapshots only the listed customers and what they hold are parsed
+        read_inputs(use_cache=not args.no_cache, customer_ids=set(customer_ids) if args.no_cache else None)
+    timeframes = args.timeframes or list(TIMEFRAMES)
+
+    if args.engine == "vector":
+        try:
+            import vector_returns
+        except ImportError:
+            print("The vector engine needs NumPy: pip install numpy")
+            sys.exit(1)
+        results = vector_returns.iter_vector_results(sys.modules[__name__], customer_ids, timeframes)
+    elif args.workers == 1:
+        results = iter_batch_results(customer_ids, timeframes)
+    else:
+        results = parallel_returns.iter_parallel_results(sys.modules[__name__], customer_ids, timeframes,
+                                                         args.workers or None, args.chunk_size)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as output_file:
+            write_batch_results(results, output_file, args.output_format)
+    else:
+        write_batch_results(results, sys.stdout, args.output_format)
 
-def valid_arguments(customer_id, timeframe):
-    return len(sys.argv) == 3 and customer_id in portfolio_data and timeframe in TIMEFRAMES
+
+def read_inputs(use_cache=True, customer_ids=None):
+    """
+    Parsed inputs, from binary snapshots when the CSVs haven't changed
+    customer_ids limits the portfolios to those customers and the prices to
+    the tickers they hold, up to the default end date
+    """
+    global price_data
+    global splits_data
+    global ticker_changes_data
+    global portfolio_data
+    # A converted prices.bin is mapped instead of loading the prices at all
+    mapped_prices = open_mapped_prices("prices.bin", "prices.csv")
+    # All files load concurrently, except filtered prices which need the portfolios first
+    sources = {
+        "splits.csv": (read_splits_input, "investment_returns", None),
+        "ticker_changes.csv": (read_ticker_changes_input, "investment_returns", None),
+    }
+    if customer_ids is None:
+        sources["portfolios.csv"] = (read_portfolio_input, "investment_returns", None)
+    else:
+        # Filtered data is never cached
+        sources["portfolios.csv"] = (partial(read_portfolio_input, customer_ids=customer_ids), None, None)
+    if mapped_prices is None and customer_ids is None:
+        sources["prices.csv"] = (read_price_input, "investment_returns", append_price_rows)
+    loaded = load_sources(sources, use_cache, heavy=["prices.csv"])
+    splits_data = loaded["splits.csv"]
+    ticker_changes_data = loaded["ticker_changes.csv"]
+    portfolio_data = loaded["portfolios.csv"]
+
+    if mapped_prices is not None:
+        price_data = mapped_prices
+        return
+    if customer_ids is None:
+        price_data = loaded["prices.csv"]
+        return
+    # Every ticker of a held ticker's chain of ticker changes, however many renames back
+    tickers = corporate_actions.linked_tickers(ticker_changes_data, portfolio_data.tickers())
+    price_data = read_price_store("prices.csv", tickers, end_date=END_DATE)
+
+
+def parse_arguments():
+    # customer ID and period, None if they aren't valid
+    if len(sys.argv) not in (3, 4) or sys.argv[1] not in portfolio_data:
+        return None
+    try:
+        return sys.argv[1], parse_period(*sys.argv[2:])
+    except ValueError:
+        return None
 
 
 if __name__ == "__main__":
+    sys.argv[1:], timing_options = timings.parse_options(sys.argv[1:])
+    timings.start(timing_options, [(sys.modules[__name__], TIMED_STAGES), (corporate_actions, ["CorporateActions"])]
+                  + TIMED_METHODS)
+
+    # Batch mode, many customers and timeframes from one load
+    if len(sys.argv) > 1 and sys.argv[1].startswith("--"):
+        run_batch(sys.argv[1:])
+        sys.exit(0)
+
     # Setup
-    price_data = read_price_input()
-    splits_data = read_splits_input()
-    ticker_changes_data = read_ticker_changes_input()
-    portfolio_data = read_portfolio_input()
+    read_inputs()
 
     # Handle arguments
-    arg_customer = sys.argv[1]
-    arg_timeframe = sys.argv[2]
-    if not valid_arguments(arg_customer, arg_timeframe):
-        print("Usage: returns.py <customer_id> <'timeframe'>")
+    arguments = parse_arguments()
+    if arguments is None:
+        print("Usage: returns.py <customer_id> <'timeframe'> [as_of_date] [--timings[=FILE]] [--profile FILE]")
+        print("       returns.py <customer_id> <start_date> [end_date]")
         print("Example: returns.py CUST001 '6 months'")
+        print("Example: returns.py CUST001 2024-03-14 2024-09-30")
         sys.exit(1)
-    print(f"{arg_customer} investment return over {arg_timeframe}")
+    arg_customer, arg_timeframe = arguments
+    print(f"{arg_customer} investment return over {describe_period(arg_timeframe)}")
 
     # Get start and end prices for each ticker in customer portfolio
     # Then calculate the return of the entire portfolio for the period
@@ -0,0 +1,64 @@
+"""
+Concurrent loading of the input files
+Each source goes through cached_read on its own thread of an asyncio loop,
+so the opens and reads of every file overlap instead of queueing behind
+each other, which is what costs on network storage
+Parsing holds the GIL, so with more than one CPU the sources named as heavy
+(prices) are parsed in a forked worker process when their snapshot can't be
+used, overlapping with the parsing of the rest in this process
+Results are exactly what cached_read returns for each source
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from snapshot_cache import cached_read, snapshot_usable
+
+
+def _read_source(source_path, read_function, name, use_cache, append_function):
+    if name is None:
+        return read_function()
+    return cached_read(source_path, read_function, name, use_cache, append_function)
+
+
+def parse_in_process(source_path, name, use_cache):
+    # Worth a process only when there is parsing to do and a CPU to do it on
+    if (os.cpu_count() or 1) <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return False
+    return not (use_cache and name is not None and snapshot_usable(source_path, name))
+
+
+async def load_sources_async(sources, use_cache=True, heavy=()):
+    """
+    sources maps a source path to (read_function, name, append_function),
+    the cached_read arguments; a None name reads without a snapshot
+    heavy names the sources to parse in a worker process when that helps
+    Returns a dict of source path to the loaded data
+    """
+    loop = asyncio.get_running_loop()
+    in_process = [source_path for source_path in sources
+                  if source_path in heavy and parse_in_process(source_path, sources[source_path][1], use_cache)]
+    process_pool = None
+    if in_process:
+        # With fork the pool launches its workers on the first submit
+        process_pool = ProcessPoolExecutor(max_workers=len(in_process), mp_context=multiprocessing.get_context("fork"))
+    try:
+        with ThreadPoolExecutor(max_workers=len(sources) or 1) as thread_pool:
+            futures = {}
+            # Process work is submitted first so the fork happens before any loader thread exists
+            for source_path in sorted(sources, key=lambda source_path: source_path not in in_process):
+                read_function, name, append_function = sources[source_path]
+                executor = process_pool if source_path in in_process else thread_pool
+                futures[source_path] = loop.run_in_executor(executor, _read_source, source_path, read_function, name,
+                                                            use_cache, append_function)
+            results = await asyncio.gather(*(futures[source_path] for source_path in sources))
+    finally:
+        if process_pool is not None:
+            process_pool.shutdown()
+    return dict(zip(sources, results))
+
+
+def load_sources(sources, use_cache=True, heavy=()):
+    # load_sources_async for callers without an event loop of their own
+    return asyncio.run(load_sources_async(sources, use_cache, heavy))
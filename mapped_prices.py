@@ -0,0 +1,128 @@
+"""
+Memory-mapped binary prices file
+Converts prices.csv into a fixed-width layout:
+    header        magic, version, ticker count, row count, source size and mtime
+    ticker table  per ticker: name (16 bytes), first row, row count
+    dates         int64 day ordinals, each ticker's rows sorted and contiguous
+    closes        float64 close prices, same order as dates
+MappedPriceStore mmaps the file and serves each ticker as memoryview slices,
+so a lookup only pages in what it touches and every process reading the
+file shares the same page cache
+Usage: python mapped_prices.py [prices.csv] [prices.bin]
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from price_store import PriceStore, read_price_store
+
+MAGIC = b"ETFPRICE"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIIQQQ")
+TICKER_ENTRY = struct.Struct("<16sQQ")
+TICKER_WIDTH = 16
+
+
+def convert_prices(csv_path="prices.csv", bin_path="prices.bin"):
+    stat = os.stat(csv_path)
+    store = read_price_store(csv_path)
+    tickers = store.tickers()
+
+    entries = []
+    row = 0
+    for ticker in tickers:
+        name = ticker.encode("utf-8")
+        if len(name) > TICKER_WIDTH:
+            raise ValueError(f"Ticker {ticker} is longer than {TICKER_WIDTH} bytes")
+        count = len(store.dates(ticker))
+        entries.append(TICKER_ENTRY.pack(name, row, count))
+        row += count
+
+    temp_path = f"{bin_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as bin_file:
+        bin_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(tickers), row, stat.st_size, stat.st_mtime_ns))
+        bin_file.writelines(entries)
+        for ticker in tickers:
+            array("q", store.dates(ticker)).tofile(bin_file)
+        for ticker in tickers:
+            store.closes(ticker).tofile(bin_file)
+    os.replace(temp_path, bin_path)
+    return row
+
+
+class MappedPriceStore(PriceStore):
+    """
+    Read-only view of a converted prices file. Tickers that get added to are
+    copied into private arrays, the rest stay in the mapping.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        with open(path, "rb") as bin_file:
+            self._map = mmap.mmap(bin_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, ticker_count, row_count, source_size, source_mtime_ns = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._map.close()
+            raise ValueError(f"{path} is not a converted prices file")
+        self.source_signature = (source_size, source_mtime_ns)
+
+        dates_offset = HEADER.size + ticker_count * TICKER_ENTRY.size
+        closes_offset = dates_offset + row_count * 8
+        view = memoryview(self._map)
+        self._all_dates = view[dates_offset:closes_offset].cast("q")
+        self._all_closes = view[closes_offset:closes_offset + row_count * 8].cast("d")
+        view.release()
+
+        for number in range(ticker_count):
+            name, start, count = TICKER_ENTRY.unpack_from(self._map, HEADER.size + number * TICKER_ENTRY.size)
+            ticker = name.rstrip(b"\0").decode("utf-8")
+            self._dates[ticker] = self._all_dates[start:start + count]
+            self._closes[ticker] = self._all_closes[start:start + count]
+
+    def _materialize(self, ticker):
+        if isinstance(self._dates.get(ticker), memoryview):
+            self._dates[ticker] = array("q", self._dates[ticker])
+            self._closes[ticker] = array("d", self._closes[ticker])
+            self._calendars.pop(ticker, None)
+
+    def add(self, ticker, day_ordinal, close_price):
+        self._materialize(ticker)
+        super().add(ticker, day_ordinal, close_price)
+
+    def add_rows(self, rows):
+        for ticker, day_ordinal, close_price in rows:
+            self.add(ticker, day_ordinal, close_price)
+
+    def add_series(self, ticker, day_ordinals, closes, ascending):
+        self._materialize(ticker)
+        super().add_series(ticker, day_ordinals, closes, ascending)
+
+    def close(self):
+        self._calendars.clear()
+        self._dates.clear()
+        self._closes.clear()
+        self._all_dates.release()
+        self._all_closes.release()
+        self._map.close()
+
+
+def open_mapped_prices(bin_path="prices.bin", csv_path="prices.csv"):
+    # MappedPriceStore for bin_path, None if it's missing or older than csv_path
+    if not os.path.exists(bin_path):
+        return None
+    store = MappedPriceStore(bin_path)
+    if os.path.exists(csv_path):
+        stat = os.stat(csv_path)
+        if store.source_signature != (stat.st_size, stat.st_mtime_ns):
+            store.close()
+            return None
+    return store
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else "prices.csv"
+    target = sys.argv[2] if len(sys.argv) > 2 else "prices.bin"
+    rows = convert_prices(source, target)
+    print(f"Wrote {rows} closes to {target}")
@@ -0,0 +1,66 @@
+"""
+Parallel batch engine for investment returns
+Customers are sharded into chunks and evaluated across a process pool
+Workers are forked after the data is loaded so the price, split, ticker change
+and portfolio data are inherited copy-on-write instead of pickled per task
+Only the customer IDs of each chunk go over the pipe
+Results come back in the same order as the requested customers
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Set in the parent before forking, inherited by the workers
+_engine = None
+_ticker_price_cache = None
+
+
+def _evaluate_chunk(customer_ids, timeframes):
+    return list(_engine.iter_batch_results(customer_ids, timeframes, _ticker_price_cache))
+
+
+def warm_ticker_price_cache(engine, customer_ids, timeframes):
+    # Resolve every held ticker once in the parent so workers share the result
+    ticker_price_cache = {}
+    tickers = set()
+    for customer_id in customer_ids:
+        if customer_id in engine.portfolio_data:
+            tickers.update(engine.portfolio_data.tickers_of(customer_id))
+    for timeframe in timeframes:
+        engine.get_cached_ticker_prices(sorted(tickers), timeframe, ticker_price_cache)
+    return ticker_price_cache
+
+
+def chunk_customers(customer_ids, chunk_size):
+    for start in range(0, len(customer_ids), chunk_size):
+        yield customer_ids[start:start + chunk_size]
+
+
+def iter_parallel_results(engine, customer_ids, timeframes, workers=None, chunk_size=1000):
+    """
+    engine is the loaded investment_returns module, passed in because it may be
+    running as __main__. Falls back to a serial run where fork isn't available.
+    """
+    global _engine
+    global _ticker_price_cache
+
+    workers = workers or os.cpu_count() or 1
+    customer_ids = list(customer_ids)
+    ticker_price_cache = warm_ticker_price_cache(engine, customer_ids, timeframes)
+
+    if workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        yield from engine.iter_batch_results(customer_ids, timeframes, ticker_price_cache)
+        return
+
+    _engine = engine
+    _ticker_price_cache = ticker_price_cache
+    try:
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            chunks = list(chunk_customers(customer_ids, chunk_size))
+            # map yields in submission order so output is deterministic
+            for results in executor.map(_evaluate_chunk, chunks, [timeframes] * len(chunks)):
+                yield from results
+    finally:
+        _engine = None
+        _ticker_price_cache = None
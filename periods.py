@@ -0,0 +1,42 @@
+"""
+Query periods shared by both scripts
+A timeframe is either one of the named TIMEFRAMES, counted back from END_DATE,
+or an explicit (start_date, end_date) pair of dates
+"""
+from datetime import date, timedelta
+
+TIMEFRAMES = {"1 day": 1, "5 days": 5, "6 months": 182, "1 year": 365}
+END_DATE = date(2024, 12, 31)
+
+
+def resolve_period(timeframe):
+    # (start_date, end_date) for a named timeframe or a date pair
+    if timeframe in TIMEFRAMES:
+        return END_DATE - timedelta(days=TIMEFRAMES[timeframe]), END_DATE
+    start_date, end_date = timeframe
+    return start_date, end_date
+
+
+def parse_period(first, second=None):
+    """
+    '<timeframe>' or '<timeframe> <as_of_date>' for a named timeframe ending
+    on as_of_date, '<start_date> [end_date]' for an explicit range ending on
+    END_DATE by default. Raises ValueError for anything else
+    """
+    if first in TIMEFRAMES:
+        if second is None:
+            return first
+        as_of = date.fromisoformat(second)
+        return as_of - timedelta(days=TIMEFRAMES[first]), as_of
+    start_date = date.fromisoformat(first)
+    end_date = date.fromisoformat(second) if second is not None else END_DATE
+    if start_date >= end_date:
+        raise ValueError(f"start date {start_date} is not before end date {end_date}")
+    return start_date, end_date
+
+
+def describe_period(timeframe):
+    if timeframe in TIMEFRAMES:
+        return timeframe
+    start_date, end_date = timeframe
+    return f"{start_date.isoformat()} to {end_date.isoformat()}"
@@ -0,0 +1,146 @@
+"""
+Columnar portfolio store for investment_returns.py
+Lots are parallel arrays grouped by customer, then by holding (a customer's
+lots of one ticker): purchase day ordinals (array 'l'), shares and cost
+basis (array 'd'), parsed once at load
+Each customer maps to a range of holdings and each holding to its ticker and
+a range of lots, so return calculations read numbers straight from the arrays
+Each ticker also maps back to the customers holding it, so a change to one
+ticker's data only needs those customers recomputed
+"""
+from array import array
+from collections import Counter
+
+from ingest import iter_portfolio_chunks
+from price_store import iso_to_ordinal
+
+
+class PortfolioStore:
+
+    def __init__(self, holding_customers=(), holding_tickers=(), lot_holdings=(), purchase_dates=(), shares=(),
+                 cost_basis=()):
+        """
+        holding_customers and holding_tickers name each holding id, the lot
+        arrays are in any order with lot_holdings giving each lot's holding id
+        Customers and their holdings keep the order they were first seen in
+        """
+        customer_numbers = {}
+        for customer_id in holding_customers:
+            customer_numbers.setdefault(customer_id, len(customer_numbers))
+        customer_order = list(map(customer_numbers.__getitem__, holding_customers))
+        order = sorted(range(len(holding_tickers)), key=customer_order.__getitem__)
+        position = array("l", bytes(len(order) * array("l").itemsize))
+
+        # Customer ID to (first holding, end holding), ticker to the customers holding it
+        self._customers = {}
+        self._ticker_customers = {}
+        self.holding_tickers = []
+        for new, old in enumerate(order):
+            position[old] = new
+            ticker = holding_tickers[old]
+            self.holding_tickers.append(ticker)
+            customer_id = holding_customers[old]
+            first, _ = self._customers.get(customer_id, (new, new))
+            self._customers[customer_id] = (first, new + 1)
+            self._ticker_customers.setdefault(ticker, []).append(customer_id)
+
+        # Stable sort by holding, so lots of one holding stay in the order given
+        lot_keys = array("l", map(position.__getitem__, lot_holdings))
+        lot_order = sorted(range(len(lot_keys)), key=lot_keys.__getitem__)
+        self.purchase_dates = array("l", map(purchase_dates.__getitem__, lot_order))
+        self.shares = array("d", map(shares.__getitem__, lot_order))
+        self.cost_basis = array("d", map(cost_basis.__getitem__, lot_order))
+
+        # Holding h owns lots holding_lots[h] to holding_lots[h + 1]
+        lot_counts = Counter(lot_keys)
+        self.holding_lots = array("l", [0])
+        for holding in range(len(order)):
+            self.holding_lots.append(self.holding_lots[holding] + lot_counts[holding])
+
+    def __contains__(self, customer_id):
+        return customer_id in self._customers
+
+    def __iter__(self):
+        return iter(self._customers)
+
+    def __len__(self):
+        return len(self._customers)
+
+    def customer_holdings(self, customer_id):
+        # (first holding, end holding) of the customer
+        return self._customers[customer_id]
+
+    def tickers_of(self, customer_id):
+        first, end = self._customers[customer_id]
+        return self.holding_tickers[first:end]
+
+    def holdings(self, customer_id):
+        # (ticker, first lot, end lot) per ticker the customer holds
+        first, end = self._customers[customer_id]
+        for holding in range(first, end):
+            yield self.holding_tickers[holding], self.holding_lots[holding], self.holding_lots[holding + 1]
+
+    def tickers(self):
+        return set(self.holding_tickers)
+
+    def customers_holding(self, ticker):
+        # Customer IDs with a holding of ticker, in customer order
+        return self._ticker_customers.get(ticker, [])
+
+    def lot_count(self):
+        return len(self.purchase_dates)
+
+    def nbytes(self):
+        total = 0
+        for column in (self.holding_lots, self.purchase_dates, self.shares, self.cost_basis):
+            total += len(column) * column.itemsize
+        # Two pointers per holding, its ticker and its entry in the ticker index, strings are shared
+        return total + len(self.holding_tickers) * 16
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        # chunks of (customer_id, ticker, purchase_date, shares, cost_basis) strings, as iter_portfolio_chunks yields
+        holding_ids = {}
+        holding_customers = []
+        holding_tickers = []
+        tickers = {}
+        day_ordinals = {}
+        lot_holdings = array("l")
+        purchase_dates = array("l")
+        shares = array("d")
+        cost_basis = array("d")
+        for lots in chunks:
+            if not lots:
+                continue
+            customer_ids, lot_tickers, purchase_date_strs, shares_qtys, lot_cost_bases = zip(*lots)
+            for customer_id, ticker in zip(customer_ids, lot_tickers):
+                # A string key rather than a tuple, strings aren't tracked by the garbage collector
+                key = customer_id + "\0" + ticker
+                holding = holding_ids.get(key)
+                if holding is None:
+                    holding = holding_ids[key] = len(holding_tickers)
+                    holding_customers.append(customer_id)
+                    holding_tickers.append(tickers.setdefault(ticker, ticker))
+                lot_holdings.append(holding)
+            # Each distinct date string is parsed once
+            for purchase_date in set(purchase_date_strs).difference(day_ordinals):
+                day_ordinals[purchase_date] = iso_to_ordinal(purchase_date)
+            purchase_dates.extend(map(day_ordinals.__getitem__, purchase_date_strs))
+            shares.extend(map(float, shares_qtys))
+            cost_basis.extend(map(float, lot_cost_bases))
+        return cls(holding_customers, holding_tickers, lot_holdings, purchase_dates, shares, cost_basis)
+
+    @classmethod
+    def from_dict(cls, data):
+        # Build from the old {customer_id: {ticker: [{"purchase_date", "shares_qty", "cost_basis"}]}} layout
+        return cls.from_chunks([
+            [(customer_id, ticker, purchase["purchase_date"], purchase["shares_qty"], purchase["cost_basis"])
+             for customer_id, holdings in data.items()
+             for ticker, purchases in holdings.items()
+             for purchase in purchases]
+        ])
+
+
+def read_portfolio_store(path="portfolios.csv", customer_ids=None):
+    # Streams the file, keeping only the customers asked for
+    return PortfolioStore.from_chunks(iter_portfolio_chunks(path, customer_ids))
@@ -0,0 +1,229 @@
+"""
+Columnar price store shared by returns.py and investment_returns.py
+Each ticker keeps two parallel arrays sorted by date:
+day ordinals (array 'l') and close prices (array 'd')
+Prices are parsed once at load so lookups never touch strings
+Date resolution goes through one SharedCalendar for the whole store; tickers
+changed since it was built fall back to their own TradingCalendar until
+build_calendars takes them back in
+"""
+from array import array
+from datetime import date
+
+from ingest import FastParseError, iter_price_chunks, iter_price_series
+from trading_calendar import SharedCalendar, TradingCalendar
+
+
+def iso_to_ordinal(date_str):
+    return date.fromisoformat(date_str).toordinal()
+
+
+class PriceStore:
+
+    def __init__(self):
+        self._dates = {}
+        self._closes = {}
+        self._calendars = {}
+        self._shared = None
+        # Tickers appended to since they were last sorted
+        self._unsorted = set()
+
+    def __contains__(self, ticker):
+        return ticker in self._dates
+
+    def __len__(self):
+        return sum(len(dates) for dates in self._dates.values())
+
+    def tickers(self):
+        return list(self._dates)
+
+    def add(self, ticker, day_ordinal, close_price):
+        dates = self._dates.get(ticker)
+        if dates is None:
+            dates = self._dates[ticker] = array("l")
+            self._closes[ticker] = array("d")
+        elif dates[-1] >= day_ordinal:
+            self._unsorted.add(ticker)
+        self._forget_calendar(ticker)
+        dates.append(day_ordinal)
+        self._closes[ticker].append(close_price)
+
+    def add_rows(self, rows):
+        # Bulk add of (ticker, day ordinal, close) rows, same result as add for each
+        last_ticker = None
+        for ticker, day_ordinal, close_price in rows:
+            if ticker != last_ticker:
+                dates = self._dates.get(ticker)
+                if dates is None:
+                    dates = self._dates[ticker] = array("l")
+                    self._closes[ticker] = array("d")
+                closes = self._closes[ticker]
+                self._forget_calendar(ticker)
+                last_ticker = ticker
+            if dates and dates[-1] >= day_ordinal:
+                self._unsorted.add(ticker)
+            dates.append(day_ordinal)
+            closes.append(close_price)
+
+    def add_series(self, ticker, day_ordinals, closes, ascending):
+        """
+        Bulk add of one ticker's rows as arrays 'l' and 'd' in file order, same
+        result as add for each; ascending says the dates strictly increase
+        """
+        dates = self._dates.get(ticker)
+        if dates is None:
+            self._dates[ticker] = day_ordinals
+            self._closes[ticker] = closes
+        else:
+            ascending = ascending and (not dates or dates[-1] < day_ordinals[0])
+            dates.extend(day_ordinals)
+            self._closes[ticker].extend(closes)
+        if not ascending:
+            self._unsorted.add(ticker)
+        self._forget_calendar(ticker)
+
+    def add_alias(self, alias, ticker):
+        # alias reads ticker's series and calendar, shared rather than copied, once ticker's rows are all added
+        self._dates[alias] = self.dates(ticker)
+        self._closes[alias] = self._closes[ticker]
+        self._forget_calendar(alias)
+        self._calendars[alias] = self.calendar(ticker)
+
+    def remove(self, ticker):
+        self._dates.pop(ticker, None)
+        self._closes.pop(ticker, None)
+        self._unsorted.discard(ticker)
+        self._forget_calendar(ticker)
+
+    def _set_series(self, ticker, by_date):
+        ordered = sorted(by_date)
+        self._dates[ticker] = array("l", ordered)
+        self._closes[ticker] = array("d", (by_date[day] for day in ordered))
+        self._unsorted.discard(ticker)
+        self._forget_calendar(ticker)
+
+    def _forget_calendar(self, ticker):
+        self._calendars.pop(ticker, None)
+        if self._shared is not None:
+            self._shared.discard(ticker)
+
+    def _sort(self, ticker):
+        # Later rows win on duplicate dates, same as the old dict layout
+        self._set_series(ticker, dict(zip(self._dates[ticker], self._closes[ticker])))
+
+    def build_calendars(self):
+        for ticker in self._dates:
+            self.calendar(ticker)
+        if self._shared is not None:
+            # Tickers added to since the shared calendar was built left it, it takes them back in place
+            changed = {ticker: self.dates(ticker) for ticker, dates in self._dates.items()
+                       if dates and ticker not in self._shared}
+            if not changed or self._shared.update(changed):
+                return
+        self._shared = SharedCalendar({ticker: self.dates(ticker) for ticker in self._dates})
+
+    def calendar(self, ticker):
+        calendar = self._calendars.get(ticker)
+        if calendar is None:
+            calendar = self._calendars[ticker] = TradingCalendar(self.dates(ticker))
+        return calendar
+
+    def dates(self, ticker):
+        if ticker in self._unsorted:
+            self._sort(ticker)
+        return self._dates[ticker]
+
+    def closes(self, ticker):
+        if ticker in self._unsorted:
+            self._sort(ticker)
+        return self._closes[ticker]
+
+    def has_close(self, ticker, day):
+        if self._shared is not None and ticker in self._shared:
+            return self._shared.has_close(ticker, day.toordinal())
+        return day.toordinal() in self.calendar(ticker)
+
+    def index_on_or_before(self, ticker, day_ordinal):
+        # Position in ticker's arrays of the last close on or before day_ordinal, -1 if none
+        if self._shared is not None and ticker in self._shared:
+            return self._shared.index_on_or_before(ticker, day_ordinal)
+        return self.calendar(ticker).index_on_or_before(day_ordinal)
+
+    def close_on_or_before(self, ticker, day):
+        # Returns (date, close) of the last close on or before day, None if there isn't one
+        index = self.index_on_or_before(ticker, day.toordinal())
+        if index < 0:
+            return None
+        return date.fromordinal(self._dates[ticker][index]), self._closes[ticker][index]
+
+    def closes_on_or_before(self, tickers, day):
+        # close_on_or_before for many tickers as a dict, resolving day once for those on the shared calendar
+        day_ordinal = day.toordinal()
+        shared = [ticker for ticker in tickers if self._shared is not None and ticker in self._shared]
+        indexes = dict(zip(shared, self._shared.indexes_on_or_before(shared, day_ordinal))) if shared else {}
+        closes = {}
+        for ticker in tickers:
+            index = indexes.get(ticker)
+            if index is None:
+                index = self.calendar(ticker).index_on_or_before(day_ordinal)
+            closes[ticker] = (date.fromordinal(self._dates[ticker][index]), self._closes[ticker][index]) \
+                if index >= 0 else None
+        return closes
+
+    def last_close_before(self, ticker, day):
+        # Date of the last close strictly before day, None if there isn't one
+        index = self.index_on_or_before(ticker, day.toordinal() - 1)
+        if index < 0:
+            return None
+        return date.fromordinal(self._dates[ticker][index])
+
+    def nbytes(self):
+        total = 0
+        for ticker, dates in self._dates.items():
+            total += len(dates) * dates.itemsize
+            total += len(self._closes[ticker]) * self._closes[ticker].itemsize
+        return total
+
+    @classmethod
+    def from_dict(cls, data):
+        # Build from the old {ticker: {"YYYY-MM-DD": "price"}} layout
+        store = cls()
+        for ticker, closes in data.items():
+            for close_date, close_price in closes.items():
+                store.add(ticker, iso_to_ordinal(close_date), float(close_price))
+        store.build_calendars()
+        return store
+
+
+def read_price_store(path="prices.csv", tickers=None, start_date=None, end_date=None):
+    # Streams the file, keeping only the tickers and inclusive date range asked for
+    store = PriceStore()
+    try:
+        for series in iter_price_series(path, tickers, start_date, end_date):
+            for ticker, day_ordinals, closes, ascending in series:
+                store.add_series(ticker, day_ordinals, closes, ascending)
+    except FastParseError:
+        # The csv reader takes what the fast parser doesn't, raising its own errors for bad rows
+        return read_price_store_csv(path, tickers, start_date, end_date)
+    store.build_calendars()
+    return store
+
+
+def read_price_store_csv(path="prices.csv", tickers=None, start_date=None, end_date=None):
+    # The same through the csv module, which takes any file the csv dialect does
+    store = PriceStore()
+    for rows in iter_price_chunks(path, tickers, start_date, end_date):
+        store.add_rows(rows)
+    store.build_calendars()
+    return store
+
+
+def append_price_rows(store, path, offset):
+    # Adds the rows after byte offset of path, returns the earliest day ordinal added or None
+    earliest = None
+    for rows in iter_price_chunks(path, offset=offset):
+        store.add_rows(rows)
+        first = min(day_ordinal for _, day_ordinal, _ in rows)
+        earliest = first if earliest is None else min(earliest, first)
+    store.build_calendars()
+    return earliest
@@ -0,0 +1,351 @@
+"""
+Time-weighted and money-weighted (XIRR) investment returns per customer
+Built on the same lots and prices as get_invest_return: lots bought by the
+period start make up the starting value, lots bought during the period are
+cash flows of cost_basis x shares on their purchase date
+TWR links the daily returns over every trading day of the period, a day's
+contributions counted as bought at that day's close, as lots are:
+    r_i = (V_i - CF_i) / V_i-1 - 1        TWR = prod(1 + r_i) - 1
+and r_i = V_i / CF_i - 1 on a day money first comes in
+XIRR is the annual rate at which the starting value and the contributions,
+grown to the end date, come to exactly the end value. Every customer is
+solved at once: Newton steps on all the rates together, falling back to
+bisection of each customer's bracket when a step would leave it
+Daily values are built for a chunk of customers at a time, so memory stays
+bounded however many customers there are. Needs NumPy
+Usage: python return_methods.py --all --timeframe '1 year' --output methods.csv
+"""
+import argparse
+import csv
+import json
+import sys
+
+import numpy as np
+
+import investment_returns
+from periods import TIMEFRAMES, resolve_period
+from vector_returns import LotArrays, calc_investment_returns, portfolio_totals
+
+# Holding x day cells valued at once, 2 MB of float64 so a chunk stays in cache
+CHUNK_CELLS = 1 << 18
+# Newton iterations before the unconverged rates are given up as NaN
+MAX_ITERATIONS = 100
+TOLERANCE = 1e-10
+# Lowest rate tried, -100% would make the growth factor zero
+LOWEST_RATE = -0.999999
+
+
+def period_days(actions, tickers, start_ordinal, end_ordinal):
+    # The period start, every close of a held ticker after it, and the period end
+    days = [np.array([start_ordinal, end_ordinal], dtype=np.int64)]
+    for ticker in tickers:
+        day_ordinals = np.asarray(actions.prices_for(ticker).dates(ticker), dtype=np.int64)
+        first, last = np.searchsorted(day_ordinals, [start_ordinal, end_ordinal], side="right")
+        days.append(day_ordinals[first:last])
+    return np.unique(np.concatenate(days))
+
+
+def start_close_days(actions, lots, start_ordinal):
+    # Each ticker's last close on or before the period start, the start date get_invest_return counts lots from
+    start_days = np.full(len(lots.tickers), start_ordinal, dtype=np.int64)
+    for number, ticker in enumerate(lots.tickers):
+        day_ordinals = np.asarray(actions.prices_for(ticker).dates(ticker), dtype=np.int64)
+        index = np.searchsorted(day_ordinals, start_ordinal, side="right") - 1
+        if index >= 0:
+            start_days[number] = day_ordinals[index]
+    return start_days
+
+
+def split_growth(actions, ticker, day_ordinals):
+    # Shares held on each day per share held before any of the ticker's splits
+    return actions.split_factors(ticker, 0, day_ordinals)
+
+
+def adjusted_closes(actions, lots, days):
+    """
+    tickers x days matrix of the last close on or before each day times the
+    split growth to that day, so a lot's value on a day is its pre-split
+    share count times the matrix entry. Also a mask of the tickers without a
+    close on or before the period start, whose rows are left at zero
+    """
+    closes = np.zeros((len(lots.tickers), len(days)))
+    missing = np.zeros(len(lots.tickers), dtype=bool)
+    for number, ticker in enumerate(lots.tickers):
+        prices = actions.prices_for(ticker)
+        day_ordinals = np.asarray(prices.dates(ticker), dtype=np.int64)
+        index = np.searchsorted(day_ordinals, days, side="right") - 1
+        if index[0] < 0:
+            missing[number] = True
+            continue
+        closes[number] = np.asarray(prices.closes(ticker))[index] * split_growth(actions, ticker, days)
+    return closes, missing
+
+
+def base_shares(actions, lots):
+    # Each lot's shares in pre-split units, the counterpart of adjusted_closes
+    shares = lots.shares.copy()
+    for ticker in lots.tickers:
+        if actions.has_splits(ticker):
+            ticker_lots = lots.lots_of(ticker)
+            shares[ticker_lots] /= split_growth(actions, ticker, lots.purchase_date[ticker_lots])
+    return shares
+
+
+def iter_daily_values(lots, closes, days, shares, start_days):
+    """
+    (first customer, end customer, values, contributions) for consecutive
+    chunks of customers, each a customers x days matrix. Lots are grouped by
+    customer and ticker, so a chunk is a contiguous run of holdings whose
+    share counts step up on the days their lots are bought
+    start_days are start_close_days, lots bought after their ticker's one are
+    contributions from the first trading day on, as in get_invest_return
+    """
+    customer_count = len(lots.customer_ids)
+    day_count = len(days)
+    new_holding = np.ones(len(lots.customer), dtype=bool)
+    new_holding[1:] = (lots.customer[1:] != lots.customer[:-1]) | (lots.ticker[1:] != lots.ticker[:-1])
+    lot_holding = np.cumsum(new_holding) - 1
+    holding_first_lot = np.flatnonzero(new_holding)
+    holding_ticker = lots.ticker[holding_first_lot]
+    customer_holdings = np.searchsorted(lots.customer[holding_first_lot], np.arange(customer_count + 1))
+    customer_lots = np.searchsorted(lots.customer, np.arange(customer_count + 1))
+    # Lots bought by their ticker's start close count from day 0, lots bought after the end from the day past it
+    first_day = np.where(lots.purchase_date <= start_days[lots.ticker], 0,
+                         np.maximum(np.searchsorted(days, lots.purchase_date, side="left"), 1))
+    amounts = lots.cost_basis * lots.shares
+    holdings_per_chunk = max(1, CHUNK_CELLS // day_count)
+
+    first_customer = 0
+    while first_customer < customer_count:
+        end_customer = max(first_customer + 1, np.searchsorted(
+            customer_holdings, customer_holdings[first_customer] + holdings_per_chunk, side="right") - 1)
+        end_customer = min(end_customer, customer_count)
+        first_holding, end_holding = customer_holdings[first_customer], customer_holdings[end_customer]
+        chunk = slice(customer_lots[first_customer], customer_lots[end_customer])
+
+        # Shares bought per holding and day, summed along the days into shares held
+        held = np.bincount((lot_holding[chunk] - first_holding) * (day_count + 1) + first_day[chunk],
+                           weights=shares[chunk], minlength=(end_holding - first_holding) * (day_count + 1))
+        held = np.cumsum(held.reshape(-1, day_count + 1)[:, :day_count], axis=1)
+        held *= closes[holding_ticker[first_holding:end_holding]]
+        # Each customer's first holdings, then their second ones and so on, rather than a reduceat
+        first = customer_holdings[first_customer:end_customer] - first_holding
+        counts = np.diff(customer_holdings[first_customer:end_customer + 1])
+        values = held[first]
+        for number in range(1, counts.max()):
+            more = np.flatnonzero(counts > number)
+            values[more] += held[first[more] + number]
+
+        # Day 0 is the starting value rather than a contribution
+        contributed = first_day[chunk] > 0
+        contributions = np.bincount(
+            (lots.customer[chunk][contributed] - first_customer) * (day_count + 1) + first_day[chunk][contributed],
+            weights=amounts[chunk][contributed], minlength=(end_customer - first_customer) * (day_count + 1))
+        yield first_customer, end_customer, values, contributions.reshape(-1, day_count + 1)[:, :day_count]
+        first_customer = end_customer
+
+
+def time_weighted_returns(values, contributions):
+    # Daily linked, NaN for customers with nothing invested on any day
+    previous = values[:, :-1]
+    flows = contributions[:, 1:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        daily_growth = np.where(previous > 0, (values[:, 1:] - flows) / previous,
+                                np.where(flows > 0, values[:, 1:] / flows, 1.0))
+        twr = np.prod(daily_growth, axis=1) - 1
+    invested = (previous > 0).any(axis=1) | (flows > 0).any(axis=1)
+    return np.where(invested, twr, np.nan)
+
+
+def xirr_gap(rates, start_values, end_values, flow_customers, flow_amounts, remaining_years, period_years):
+    # End value less everything grown at rates to the end date, and its derivative in the rate
+    customer_count = len(rates)
+    growth = 1 + rates
+    flow_growth = growth[flow_customers] ** remaining_years
+    gap = (end_values - start_values * growth ** period_years
+           - np.bincount(flow_customers, weights=flow_amounts * flow_growth, minlength=customer_count))
+    slope = -(start_values * period_years * growth ** (period_years - 1)
+              + np.bincount(flow_customers, weights=flow_amounts * remaining_years * flow_growth
+                            / growth[flow_customers], minlength=customer_count))
+    return gap, slope
+
+
+def xirr(start_values, end_values, flow_customers, flow_amounts, flow_years, period_years):
+    """
+    Annual rate per customer solving
+        end_value = start_value (1 + r)^T + sum(amount (1 + r)^(T - t))
+    with flows given flat as (customer, amount, t in years from the start)
+    Decreasing in r, so the root is unique and bracketed by a rate where it's
+    positive and one where it's negative. NaN where there is no root
+    """
+    customer_count = len(start_values)
+    remaining_years = period_years - flow_years
+    flows = (flow_customers, flow_amounts, remaining_years)
+    low = np.full(customer_count, LOWEST_RATE)
+    high = np.ones(customer_count)
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        # No root unless the gap is positive at the lowest rate
+        gap, _ = xirr_gap(low, start_values, end_values, *flows, period_years)
+        solvable = gap > 0
+        # Widen the top of each bracket until the gap goes negative
+        for _ in range(64):
+            gap, _ = xirr_gap(high, start_values, end_values, *flows, period_years)
+            widen = solvable & (gap > 0)
+            if not widen.any():
+                break
+            low = np.where(widen, high, low)
+            high = np.where(widen, high * 4 + 1, high)
+        solvable &= ~widen
+
+        # Start from the modified Dietz return, annualised, which is usually close
+        invested = start_values + np.bincount(flow_customers, weights=flow_amounts * remaining_years / period_years,
+                                              minlength=customer_count)
+        gain = end_values - start_values - np.bincount(flow_customers, weights=flow_amounts, minlength=customer_count)
+        guess = (1 + gain / invested) ** (1 / period_years) - 1
+        rates = np.clip(np.where(np.isfinite(guess), guess, 0.0), low, high)
+
+        # Customers drop out as they converge, taking their flows with them
+        active = np.flatnonzero(solvable)
+        flows = subset_flows(flows, solvable)
+        for _ in range(MAX_ITERATIONS):
+            if not len(active):
+                break
+            gap, slope = xirr_gap(rates[active], start_values[active], end_values[active], *flows, period_years)
+            low[active] = np.where(gap > 0, rates[active], low[active])
+            high[active] = np.where(gap < 0, rates[active], high[active])
+            newton = rates[active] - gap / slope
+            inside = np.isfinite(newton) & (newton > low[active]) & (newton < high[active])
+            stepped = np.where(inside, newton, (low[active] + high[active]) / 2)
+            done = np.abs(stepped - rates[active]) <= TOLERANCE * (1 + np.abs(rates[active]))
+            rates[active] = np.where(done, rates[active], stepped)
+            if done.any():
+                active = active[~done]
+                flows = subset_flows(flows, ~done)
+    solvable[active] = False
+    return np.where(solvable, rates, np.nan)
+
+
+def subset_flows(flows, keep):
+    # The flows of the customers kept, renumbered to count only those
+    flow_customers, flow_amounts, remaining_years = flows
+    numbers = np.cumsum(keep) - 1
+    kept = keep[flow_customers]
+    return numbers[flow_customers[kept]], flow_amounts[kept], remaining_years[kept]
+
+
+def period_methods(engine, lots, timeframe, ticker_price_cache):
+    """
+    start, current and contribution totals, simple return percentage, TWR
+    and XIRR percentages and the customers missing prices, one entry per
+    customer of lots
+    """
+    actions = engine.get_corporate_actions()
+    start_total, current_total, contribution_total, customer_missing = portfolio_totals(
+        engine, lots, timeframe, ticker_price_cache)
+    _, return_percentage = calc_investment_returns(start_total, current_total, contribution_total)
+
+    start_date, end_date = resolve_period(timeframe)
+    start_ordinal, end_ordinal = start_date.toordinal(), end_date.toordinal()
+    days = period_days(actions, lots.tickers, start_ordinal, end_ordinal)
+    closes, _ = adjusted_closes(actions, lots, days)
+    shares = base_shares(actions, lots)
+    start_days = start_close_days(actions, lots, start_ordinal)
+
+    customer_count = len(lots.customer_ids)
+    twr = np.full(customer_count, np.nan)
+    start_values = np.zeros(customer_count)
+    end_values = np.zeros(customer_count)
+    chunks = iter_daily_values(lots, closes, days, shares, start_days)
+    for first_customer, end_customer, values, contributions in chunks:
+        twr[first_customer:end_customer] = time_weighted_returns(values, contributions)
+        start_values[first_customer:end_customer] = values[:, 0]
+        end_values[first_customer:end_customer] = values[:, -1]
+
+    # Contributions at their actual purchase dates, not the trading day they're valued from
+    contributed = (lots.purchase_date > start_days[lots.ticker]) & (lots.purchase_date <= end_ordinal)
+    rates = xirr(start_values, end_values, lots.customer[contributed],
+                 (lots.cost_basis * lots.shares)[contributed],
+                 (lots.purchase_date[contributed] - start_ordinal) / 365, (end_ordinal - start_ordinal) / 365)
+    return (start_total, current_total, contribution_total, return_percentage, twr * 100, rates * 100,
+            customer_missing)
+
+
+def iter_method_results(engine, customer_ids, timeframes, ticker_price_cache=None, lots=None):
+    # One row per customer and timeframe, in the order asked for
+    if ticker_price_cache is None:
+        ticker_price_cache = {}
+    if lots is None:
+        lots = LotArrays(engine.portfolio_data)
+
+    by_timeframe = {timeframe: [column.tolist() for column in period_methods(engine, lots, timeframe,
+                                                                               ticker_price_cache)]
+                    for timeframe in timeframes}
+    for customer_id in customer_ids:
+        number = lots.customer_index.get(customer_id)
+        for timeframe in timeframes:
+            if number is None:
+                yield {"customer_id": customer_id, "timeframe": timeframe, "error": "unknown customer"}
+                continue
+            start_total, current_total, contribution_total, return_percentage, twr, rates, customer_missing = \
+                by_timeframe[timeframe]
+            if customer_missing[number]:
+                ticker = engine.missing_ticker(customer_id, timeframe, ticker_price_cache)
+                yield {"customer_id": customer_id, "timeframe": timeframe,
+                       "error": f"requested period for {ticker} not found"}
+                continue
+            yield {
+                "customer_id": customer_id,
+                "timeframe": timeframe,
+                "start_total": start_total[number],
+                "current_total": current_total[number],
+                "contribution_total": contribution_total[number],
+                "return_percentage": return_percentage[number],
+                "twr_percentage": twr[number] if twr[number] == twr[number] else None,
+                "xirr_percentage": rates[number] if rates[number] == rates[number] else None,
+                "error": "",
+            }
+
+
+METHOD_FIELDS = ["customer_id", "timeframe", "start_total", "current_total", "contribution_total",
+                 "return_percentage", "twr_percentage", "xirr_percentage", "error"]
+
+
+def write_method_results(results, output_file, output_format):
+    if output_format == "jsonl":
+        for result in results:
+            output_file.write(json.dumps(result) + "\n")
+        return
+    writer = csv.DictWriter(output_file, fieldnames=METHOD_FIELDS, restval="")
+    writer.writeheader()
+    for result in results:
+        writer.writerow({field: "" if value is None else value for field, value in result.items()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time-weighted and money-weighted returns per customer")
+    customers = parser.add_mutually_exclusive_group(required=True)
+    customers.add_argument("--all", action="store_true", help="Every customer in portfolios.csv")
+    customers.add_argument("--customers-file", help="File with one customer ID per line")
+    parser.add_argument("--timeframe", action="append", choices=list(TIMEFRAMES), dest="timeframes",
+                        help="Timeframe to calculate, repeatable (default: all)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv", dest="output_format")
+    parser.add_argument("--output", help="Output file (default: stdout)")
+    args = parser.parse_args()
+
+    investment_returns.read_inputs()
+    if args.all:
+        customer_ids = list(investment_returns.portfolio_data)
+    else:
+        customer_ids = investment_returns.read_customers_file(args.customers_file)
+    timeframes = args.timeframes or list(TIMEFRAMES)
+
+    results = iter_method_results(investment_returns, customer_ids, timeframes)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as output_file:
+            write_method_results(results, output_file, args.output_format)
+    else:
+        write_method_results(results, sys.stdout, args.output_format)
+
+
+if __name__ == "__main__":
+    main()
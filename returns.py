@@ -2,17 +2,31 @@
 Calculates price return for an ETF over a period of time
 Splits and ticker changes are considered
 Takes ETF ticker and timeframe as inputs
+Batch mode (--all, --tickers, --tickers-file) writes every requested
+ticker and timeframe from one load
 """
+import argparse
 import sys
 import csv
-from datetime import date, timedelta, datetime
-
-TIMEFRAMES = {
-    "1 day": 1,
-    "5 days": 5,
-    "6 months": 182,
-    "1 year": 365
-}
+import json
+from datetime import date, datetime
+
+import corporate_actions
+import timings
+from loader import load_sources
+from mapped_prices import open_mapped_prices
+from periods import TIMEFRAMES, describe_period, parse_period, resolve_period
+from price_store import PriceStore, append_price_rows, read_price_store
+
+# Resolved prices kept per (ticker, start, end)
+PRICE_CACHE_SIZE = 4096
+
+# Functions timed by --timings
+TIMED_STAGES = ["open_mapped_prices", "load_sources", "read_price_input", "read_splits_input",
+                "read_ticker_changes_input", "get_corporate_actions", "handle_ticker_change",
+                "handle_split_calculation", "get_prices_for_period", "resolve_ticker_periods"]
+# Date resolution, single queries go through the view and batches through the store
+TIMED_METHODS = [(corporate_actions.CorporateActions, ["close_on_or_before"]), (PriceStore, ["index_on_or_before"])]
 
 price_data = None
 splits_data = None
@@ -23,110 +37,248 @@ def calc_price_return(end_price, start_price):
     return (end_price / start_price - 1) * 100
 
 
+def get_corporate_actions():
+    # Ticker changes and splits resolved once per loaded dataset
+    return corporate_actions.view(price_data, splits_data, ticker_changes_data)
+
+
+def get_price_cache():
+    return get_corporate_actions().cache("returns", PRICE_CACHE_SIZE)
+
+
 def handle_ticker_change(ticker):
-    changed_tickers = []
-    for _, changed_ticker in ticker_changes_data[ticker]:
-        price_data[ticker].update(price_data[changed_ticker])
-        changed_tickers.append(changed_ticker)
-    return changed_tickers
+    # Merged price history is precomputed, this only names the other tickers
+    return get_corporate_actions().aka_tickers(ticker)[:-1]
 
 
 def handle_split_calculation(ticker, start_date, end_date, price):
-    splits = splits_data[ticker]
-    adjusted_price = price
-    for split_date_str, split_ratio in splits.items():
-        split_date = datetime.strptime(split_date_str, "%d/%m/%Y").date()
-        # Only action splits that have occurred within timeframe
-        if start_date < split_date < end_date:
-            from_quantity, to_quantity = split_ratio
-            adjusted_price *= (float(from_quantity) / float(to_quantity))
-    return adjusted_price
-
-
-def merge_dates(left, right):
-    sorted_dates = []
-    i = 0
-    j = 0
-    while i < len(left) and j < len(right):
-        left_date = datetime.strptime(left[i], "%Y-%m-%d").date()
-        right_date = datetime.strptime(right[j], "%Y-%m-%d").date()
-        if left_date < right_date:
-            sorted_dates.append(left[i])
-            i += 1
-        else:
-            sorted_dates.append(right[j])
-            j += 1
-
-    sorted_dates.extend(left[i:])
-    sorted_dates.extend(right[j:])
-    return sorted_dates
+    # Only action splits that have occurred within timeframe
+    split_factor = get_corporate_actions().split_factor(ticker, start_date.toordinal(), end_date.toordinal(),
+                                                        include_through=False)
+    return price / split_factor
 
 
 def sort_dates(dates):
-    # Merge sort !
-    if len(dates) <= 1:
-        return dates
+    # Parse each date once and let sorted do the work
+    return sorted(dates, key=lambda date_str: datetime.strptime(date_str, "%Y-%m-%d"))
 
-    middle = len(dates) // 2
-    left = sort_dates(dates[:middle])
-    right = sort_dates(dates[middle:])
-    
-    return merge_dates(left, right)
 
 def get_last_close_date(ticker, start_date):
-    # Dict is aleady sorted from input but sorting for case it isnt
-    # Binary search to find it!
-    all_dates = sort_dates(list(price_data[ticker].keys()))
-    left = 0
-    right = len(all_dates) - 1
-
-    last_close_date = None
-    while left <= right:
-        middle = left + ((right - left) // 2)
-        date_to_check = datetime.strptime(all_dates[middle], "%Y-%m-%d").date()
-        if date_to_check > start_date:
-            right = middle - 1
-        elif date_to_check < start_date:
-            last_close_date = date_to_check
-            left = middle + 1
-        else:
-            return None
-    return last_close_date
+    # The store's shared calendar resolves start_date once for every ticker
+    return get_corporate_actions().prices_for(ticker).last_close_before(ticker, start_date)
 
 
-def get_prices_for_period(ticker, timeframe):
-    end_date = date(2024, 12, 31)
-    start_date = end_date - timedelta(days=TIMEFRAMES[timeframe])
-
+def resolve_prices(ticker, start_date, end_date):
     # Handle potential ticker changes
     aka_tickers = []
     if ticker in ticker_changes_data:
         aka_tickers = handle_ticker_change(ticker)
     aka_tickers.append(ticker)
 
-    # When date is a weekend or holiday, find last close price
-    if start_date.strftime("%Y-%m-%d") not in price_data[ticker]:
-        start_date = get_last_close_date(ticker, start_date)
-        if not start_date:
-            print(f"Requested period for {ticker} not found")
-            sys.exit(1)
-
-    end_date_str = end_date.strftime("%Y-%m-%d")
-    start_date_str = start_date.strftime("%Y-%m-%d")
-
-    end_close_price = float(price_data[ticker][end_date_str])
-    start_close_price = float(price_data[ticker][start_date_str])
+    # When date is a weekend or holiday, use the last close before it
+    actions = get_corporate_actions()
+    start_close = actions.close_on_or_before(ticker, start_date)
+    end_close = actions.close_on_or_before(ticker, end_date)
+    if not start_close or not end_close:
+        return None
+    start_date, start_close_price = start_close
+    end_date, end_close_price = end_close
 
     # Handle split if one has occured during period
     for aka_ticker in aka_tickers:
         if aka_ticker in splits_data:
             start_close_price = handle_split_calculation(aka_ticker, start_date,
                                                          end_date, start_close_price)
+    return start_date, start_close_price, end_date, end_close_price
+
+
+def get_cached_prices(ticker, start_date, end_date):
+    price_cache = get_price_cache()
+    key = (ticker, start_date.toordinal(), end_date.toordinal())
+    prices = price_cache.get(key, False)
+    if prices is False:
+        prices = resolve_prices(ticker, start_date, end_date)
+        price_cache[key] = prices
+    return prices
+
 
+def get_prices_for_period(ticker, timeframe):
+    # timeframe is a TIMEFRAMES name or a (start_date, end_date) pair
+    prices = get_cached_prices(ticker, *resolve_period(timeframe))
+    if prices is None:
+        print(f"Requested period for {ticker} not found")
+        sys.exit(1)
+    start_date, start_close_price, end_date, end_close_price = prices
+
+    end_date_str = end_date.strftime("%Y-%m-%d")
+    start_date_str = start_date.strftime("%Y-%m-%d")
     print(f"Period {start_date_str} to {end_date_str}")
     return end_close_price, start_close_price
 
 
+def resolve_ticker_periods(ticker, periods):
+    """
+    resolve_prices for each (start_date, end_date) in periods, looking up the
+    ticker's aliases, merged close series and split tickers only once
+    """
+    actions = get_corporate_actions()
+    split_tickers = [aka_ticker for aka_ticker in actions.aka_tickers(ticker) if aka_ticker in splits_data]
+    prices = actions.prices_for(ticker)
+    day_ordinals = prices.dates(ticker)
+    closes = prices.closes(ticker)
+    resolved = []
+    for start_date, end_date in periods:
+        # When date is a weekend or holiday, use the last close before it
+        start_index = prices.index_on_or_before(ticker, start_date.toordinal())
+        end_index = prices.index_on_or_before(ticker, end_date.toordinal())
+        if start_index < 0 or end_index < 0:
+            resolved.append(None)
+            continue
+        start_close_price = closes[start_index]
+        for aka_ticker in split_tickers:
+            start_close_price = start_close_price / actions.split_factor(
+                aka_ticker, day_ordinals[start_index], day_ordinals[end_index], include_through=False)
+        resolved.append((date.fromordinal(day_ordinals[start_index]), start_close_price,
+                         date.fromordinal(day_ordinals[end_index]), closes[end_index]))
+    return resolved
+
+
+def iter_batch_results(tickers, timeframes, as_of=None):
+    # One row per ticker and timeframe, all of a ticker's timeframes resolved together
+    periods = [resolve_period(timeframe if as_of is None else parse_period(timeframe, as_of))
+               for timeframe in timeframes]
+    for ticker in tickers:
+        if ticker not in price_data:
+            for timeframe in timeframes:
+                yield {"ticker": ticker, "timeframe": timeframe, "error": "unknown ticker"}
+            continue
+        for timeframe, prices in zip(timeframes, resolve_ticker_periods(ticker, periods)):
+            if prices is None:
+                yield {"ticker": ticker, "timeframe": timeframe, "error": f"requested period for {ticker} not found"}
+                continue
+            start_date, start_close_price, end_date, end_close_price = prices
+            yield {
+                "ticker": ticker,
+                "timeframe": timeframe,
+                "start_date": start_date.isoformat(),
+                "end_date": end_date.isoformat(),
+                "start_price": start_close_price,
+                "end_price": end_close_price,
+                "return_percentage": calc_price_return(end_close_price, start_close_price),
+                "error": "",
+            }
+
+
+BATCH_FIELDS = ["ticker", "timeframe", "start_date", "end_date", "start_price", "end_price", "return_percentage",
+                "error"]
+
+
+def sort_batch_results(results, field, descending=False):
+    # Rows without the field, errors included, go last either way
+    results = list(results)
+    present = [result for result in results if result.get(field) not in (None, "")]
+    missing = [result for result in results if result.get(field) in (None, "")]
+    return sorted(present, key=lambda result: result[field], reverse=descending) + missing
+
+
+def format_table_value(field, value):
+    if value == "":
+        return ""
+    if field == "return_percentage":
+        return f"{value:+.2f}%"
+    if field in ("start_price", "end_price"):
+        return str(round(value, 6))
+    return str(value)
+
+
+def write_batch_results(results, output_file, output_format):
+    if output_format == "jsonl":
+        for result in results:
+            output_file.write(json.dumps(result) + "\n")
+        return
+    if output_format == "table":
+        rows = [[format_table_value(field, result.get(field, "")) for field in BATCH_FIELDS] for result in results]
+        widths = [max([len(field)] + [len(row[column]) for row in rows]) for column, field in enumerate(BATCH_FIELDS)]
+        for row in [BATCH_FIELDS] + rows:
+            output_file.write("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() + "\n")
+        return
+    writer = csv.DictWriter(output_file, fieldnames=BATCH_FIELDS, restval="")
+    writer.writeheader()
+    for result in results:
+        writer.writerow(result)
+
+
+def read_tickers_file(path):
+    with open(path, encoding="utf-8") as tickers_file:
+        return [line.strip() for line in tickers_file if line.strip()]
+
+
+def parse_batch_arguments(argv):
+    parser = argparse.ArgumentParser(
+        prog="returns.py",
+        description="Price returns for many tickers and timeframes in one run",
+    )
+    tickers = parser.add_mutually_exclusive_group(required=True)
+    tickers.add_argument("--all", action="store_true", help="Every ticker in prices.csv")
+    tickers.add_argument("--tickers", nargs="+", help="Tickers to calculate")
+    tickers.add_argument("--tickers-file", help="File with one ticker per line")
+    parser.add_argument("--timeframe", action="append", choices=list(TIMEFRAMES), dest="timeframes",
+                        help="Timeframe to calculate, repeatable (default: all)")
+    parser.add_argument("--as-of", help="End the timeframes on this date instead of the default end date")
+    parser.add_argument("--format", choices=["csv", "jsonl", "table"], default="csv", dest="output_format")
+    parser.add_argument("--sort-by", choices=BATCH_FIELDS, help="Field to sort the rows by (default: input order)")
+    parser.add_argument("--descending", action="store_true", help="Sort largest first")
+    parser.add_argument("--output", help="Output file (default: stdout)")
+    return parser.parse_args(argv)
+
+
+def run_batch(argv):
+    args = parse_batch_arguments(argv)
+    if args.as_of:
+        try:
+            parse_period(next(iter(TIMEFRAMES)), args.as_of)
+        except ValueError:
+            print(f"Invalid --as-of date {args.as_of}")
+            sys.exit(1)
+    read_inputs()
+    if args.all:
+        tickers = price_data.tickers()
+    elif args.tickers:
+        tickers = args.tickers
+    else:
+        tickers = read_tickers_file(args.tickers_file)
+    timeframes = args.timeframes or list(TIMEFRAMES)
+
+    results = iter_batch_results(tickers, timeframes, args.as_of)
+    if args.sort_by:
+        results = sort_batch_results(results, args.sort_by, args.descending)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as output_file:
+            write_batch_results(results, output_file, args.output_format)
+    else:
+        write_batch_results(results, sys.stdout, args.output_format)
+
+
+def read_inputs():
+    # Parsed inputs come from binary snapshots when the CSVs haven't changed, all files load concurrently
+    # A converted prices.bin is mapped instead of loading the prices at all
+    global price_data
+    global splits_data
+    global ticker_changes_data
+    price_data = open_mapped_prices("prices.bin", "prices.csv")
+    sources = {
+        "splits.csv": (read_splits_input, "returns", None),
+        "ticker_changes.csv": (read_ticker_changes_input, "returns", None),
+    }
+    if price_data is None:
+        sources["prices.csv"] = (read_price_input, "returns", append_price_rows)
+    loaded = load_sources(sources, heavy=["prices.csv"])
+    splits_data = loaded["splits.csv"]
+    ticker_changes_data = loaded["ticker_changes.csv"]
+    if price_data is None:
+        price_data = loaded["prices.csv"]
+
+
 def read_ticker_changes_input():
     data = {}
     with open("ticker_changes.csv", encoding="utf-8") as ticker_changes_file:
@@ -136,13 +288,13 @@ def read_ticker_changes_input():
             effective_date = row["effective_date"]
             new_ticker = row["new_ticker"]
 
+            # Changes are listed under the old ticker, the new one is a key so it's known to have a change
             if old_ticker not in data:
                 data[old_ticker] = []
             data[old_ticker].append([effective_date, new_ticker])
 
             if new_ticker not in data:
                 data[new_ticker] = []
-            data[new_ticker].append([effective_date, old_ticker])
         return data
 
 
@@ -163,37 +315,43 @@ def read_splits_input():
 
 
 def read_price_input():
-    data = {}
-    with open("prices.csv", encoding="utf-8") as price_file:
-        reader = csv.DictReader(price_file)
-        for row in reader:
-            ticker = row["ticker"]
-            close_date = row["date"]
-            close_price = row["close_price"]
+    return read_price_store("prices.csv")
 
-            if ticker not in data:
-                data[ticker] = {}
-            data[ticker][close_date] = close_price
-        return data
 
-
-def valid_arguments(ticker, timeframe):
-    return len(sys.argv) == 3 and ticker in price_data and timeframe in TIMEFRAMES
+def parse_arguments():
+    # ticker and period, None if they aren't valid
+    if len(sys.argv) not in (3, 4) or sys.argv[1] not in price_data:
+        return None
+    try:
+        return sys.argv[1], parse_period(*sys.argv[2:])
+    except ValueError:
+        return None
 
 
 if __name__ == "__main__":
-    price_data = read_price_input()
-    splits_data = read_splits_input()
-    ticker_changes_data = read_ticker_changes_input()
-    arg_ticker = sys.argv[1]
-    arg_timeframe = sys.argv[2]
+    sys.argv[1:], timing_options = timings.parse_options(sys.argv[1:])
+    timings.start(timing_options, [(sys.modules[__name__], TIMED_STAGES), (corporate_actions, ["CorporateActions"])]
+                  + TIMED_METHODS)
+
+    # Batch mode, many tickers and timeframes from one load
+    if len(sys.argv) > 1 and sys.argv[1].startswith("--"):
+        run_batch(sys.argv[1:])
+        sys.exit(0)
+
+    read_inputs()
 
-    if not valid_arguments(arg_ticker, arg_timeframe):
-        print("Usage: returns.py <ticker> <'timeframe'>")
+    arguments = parse_arguments()
+    if arguments is None:
+        print("Usage: returns.py <ticker> <'timeframe'> [as_of_date] [--timings[=FILE]] [--profile FILE]")
+        print("       returns.py <ticker> <start_date> [end_date]")
         print("Example: returns.py NDQ '6 months'")
+        print("Example: returns.py NDQ 2024-03-14 2024-09-30")
+        print("Batch:   returns.py --all | --tickers NDQ A200 | --tickers-file FILE [--timeframe '1 year'] "
+              "[--format csv|jsonl|table] [--sort-by FIELD] [--descending]")
         sys.exit(1)
+    arg_ticker, arg_timeframe = arguments
 
-    print(f"Price return for {arg_ticker} for {arg_timeframe}")
+    print(f"Price return for {arg_ticker} for {describe_period(arg_timeframe)}")
 
     end_price_final, start_price_final = get_prices_for_period(arg_ticker, arg_timeframe)
     result = calc_price_return(end_price_final, start_price_final)
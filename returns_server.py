@@ -0,0 +1,325 @@
+"""
+Long-running query server for price and investment returns
+Loads the data once and answers JSON-lines requests over TCP or a Unix socket
+Each request is one JSON object per line, each response one line back:
+    {"id": 1, "method": "price_return", "ticker": "NDQ", "timeframe": "6 months"}
+    {"id": 2, "method": "investment_return", "customer_id": "CUST001", "timeframe": "1 year"}
+    {"id": 3, "method": "price_return", "ticker": "NDQ", "start_date": "2024-03-14", "end_date": "2024-09-30"}
+    {"id": 4, "method": "investment_return", "customer_id": "CUST001", "timeframe": "6 months", "as_of": "2024-09-30"}
+    {"id": 5, "method": "stats"}
+Resolved prices are held in bounded LRU caches, whose hit rate and evictions
+are part of stats
+Changed CSVs are reloaded in a background thread and swapped in between
+requests, so in-flight requests finish against the data they started with
+Investment results are cached per customer too; a reload keeps the cached
+prices and results that don't depend on a ticker whose data changed, so a
+correction to one ETF only recomputes the customers holding it
+Rows appended to prices.csv are parsed on their own and added to the loaded
+prices instead, keeping cached results that end before the new rows
+Requests are answered one at a time on the event loop, not in an executor:
+a cache miss holds up other clients for its whole computation, but the
+caches and the swap between requests need no locks, and threads wouldn't
+run the pure Python lookups in parallel anyway
+Usage: python returns_server.py --port 8765
+       python returns_server.py --unix /tmp/returns.sock
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import time
+from collections import deque
+
+import corporate_actions
+import investment_returns
+import returns
+from ingest import iter_price_chunks
+from loader import load_sources
+from mapped_prices import MappedPriceStore, open_mapped_prices
+from periods import describe_period, parse_period, resolve_period
+from price_store import append_price_rows
+from snapshot_cache import appended_to, tail_fingerprint
+
+SOURCES = ["prices.csv", "splits.csv", "ticker_changes.csv", "portfolios.csv"]
+
+
+class LatencyStats:
+
+    def __init__(self, window=10000):
+        self.count = 0
+        self.errors = 0
+        # Only the most recent requests count towards the percentiles
+        self._latencies = deque(maxlen=window)
+
+    def record(self, seconds, ok):
+        self.count += 1
+        if not ok:
+            self.errors += 1
+        self._latencies.append(seconds)
+
+    def percentile(self, fraction):
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self):
+        p50 = self.percentile(0.50)
+        p99 = self.percentile(0.99)
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "p50_ms": round(p50 * 1000, 3) if p50 is not None else None,
+            "p99_ms": round(p99 * 1000, 3) if p99 is not None else None,
+        }
+
+
+def source_signatures():
+    signatures = {}
+    for path in SOURCES:
+        stat = os.stat(path)
+        signatures[path] = (stat.st_size, stat.st_mtime_ns)
+    return signatures
+
+
+def load_dataset():
+    # Builds a fresh copy of the data without touching the module globals
+    # Runs on a thread of its own when reloading, so sources load on threads only, never forked
+    signatures = source_signatures()
+    price_data = open_mapped_prices("prices.bin", "prices.csv")
+    sources = {
+        "splits.csv": (investment_returns.read_splits_input, "investment_returns", None),
+        "ticker_changes.csv": (investment_returns.read_ticker_changes_input, "investment_returns", None),
+        "portfolios.csv": (investment_returns.read_portfolio_input, "investment_returns", None),
+    }
+    if price_data is None:
+        sources["prices.csv"] = (investment_returns.read_price_input, "investment_returns", append_price_rows)
+    loaded = load_sources(sources)
+    return {
+        "signatures": signatures,
+        "prices_tail": tail_fingerprint("prices.csv", signatures["prices.csv"][0]),
+        "price_data": price_data if price_data is not None else loaded["prices.csv"],
+        "splits_data": loaded["splits.csv"],
+        "ticker_changes_data": loaded["ticker_changes.csv"],
+        "portfolio_data": loaded["portfolios.csv"],
+    }
+
+
+class ReturnsServer:
+
+    def __init__(self, reload_interval=2.0):
+        self.reload_interval = reload_interval
+        self.signatures = None
+        self.loaded_at = None
+        self.prices_tail = None
+        self.reloads = 0
+        self.appends = 0
+        self.stale_customers = None
+        self.stats = {}
+
+    def install(self, dataset):
+        # Runs on the event loop between requests so nobody sees a half swapped dataset
+        old_actions = investment_returns.get_corporate_actions() if self.signatures is not None else None
+        for module in (returns, investment_returns):
+            module.price_data = dataset["price_data"]
+            module.splits_data = dataset["splits_data"]
+            module.ticker_changes_data = dataset["ticker_changes_data"]
+        investment_returns.portfolio_data = dataset["portfolio_data"]
+        # The new data gets a fresh corporate actions view, taking over the cached results still valid
+        if old_actions is not None:
+            self.carry_caches(old_actions, dataset["signatures"])
+        self.signatures = dataset["signatures"]
+        self.prices_tail = dataset["prices_tail"]
+        self.loaded_at = time.time()
+
+    def carry_caches(self, old_actions, signatures):
+        new_actions = investment_returns.get_corporate_actions()
+        changed = corporate_actions.changed_tickers(old_actions, new_actions)
+        keep_entry, stale_customers = investment_returns.stale_entries(old_actions, new_actions, changed)
+        # Any customer's lots may differ in a changed portfolios.csv
+        portfolios_changed = signatures["portfolios.csv"] != self.signatures["portfolios.csv"]
+
+        def keep(name, key):
+            if portfolios_changed and name == "investment_results":
+                return False
+            return keep_entry(name, key)
+        corporate_actions.carry_caches(old_actions, new_actions, keep)
+        self.stale_customers = None if portfolios_changed else len(stale_customers)
+
+    def prices_appended(self, signatures):
+        # Only prices.csv changed, by rows added at the end, and the prices are in memory
+        changed = [path for path in SOURCES if signatures[path] != self.signatures[path]]
+        if changed != ["prices.csv"] or isinstance(returns.price_data, MappedPriceStore):
+            return False
+        return appended_to({"size": self.signatures["prices.csv"][0], "tail": self.prices_tail}, "prices.csv")
+
+    def append_prices(self, chunks, signatures):
+        # Runs on the event loop like install, the parsing already happened in a thread
+        price_data = returns.price_data
+        earliest = None
+        tickers = set()
+        for rows in chunks:
+            price_data.add_rows(rows)
+            first = min(day_ordinal for _, day_ordinal, _ in rows)
+            earliest = first if earliest is None else min(earliest, first)
+            tickers.update(ticker for ticker, _, _ in rows)
+        if earliest is not None:
+            price_data.build_calendars()
+            corporate_actions.refresh_prices(price_data, earliest, tickers)
+        self.signatures = signatures
+        self.prices_tail = tail_fingerprint("prices.csv", signatures["prices.csv"][0])
+
+    async def watch_sources(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                signatures = source_signatures()
+                if signatures == self.signatures:
+                    continue
+                if self.prices_appended(signatures):
+                    offset = self.signatures["prices.csv"][0]
+                    chunks = await asyncio.to_thread(lambda: list(iter_price_chunks("prices.csv", offset=offset)))
+                    self.append_prices(chunks, signatures)
+                    self.appends += 1
+                    continue
+                dataset = await asyncio.to_thread(load_dataset)
+            except (OSError, ValueError) as error:
+                # Keep serving the old data if a file is mid-write or broken
+                print(f"Reload failed: {error}")
+                continue
+            self.install(dataset)
+            self.reloads += 1
+
+    def request_period(self, request):
+        # Named timeframe with an optional as_of date, or start_date with an optional end_date
+        try:
+            if "start_date" in request:
+                return parse_period(request["start_date"], request.get("end_date"))
+            return parse_period(request.get("timeframe"), request.get("as_of"))
+        except (TypeError, ValueError):
+            raise ValueError("unknown timeframe or bad dates") from None
+
+    def price_return(self, request):
+        ticker = request.get("ticker")
+        if ticker not in returns.price_data:
+            raise ValueError("unknown ticker")
+        timeframe = self.request_period(request)
+        prices = returns.get_cached_prices(ticker, *resolve_period(timeframe))
+        if prices is None:
+            raise ValueError(f"requested period for {ticker} not found")
+        _, start_price, _, end_price = prices
+        return {
+            "ticker": ticker,
+            "timeframe": describe_period(timeframe),
+            "start_price": start_price,
+            "end_price": end_price,
+            "return_percentage": returns.calc_price_return(end_price, start_price),
+        }
+
+    def investment_return(self, request):
+        customer_id = request.get("customer_id")
+        timeframe = self.request_period(request)
+        result = investment_returns.get_cached_return(customer_id, timeframe)
+        if result["error"]:
+            raise ValueError(result["error"])
+        result["timeframe"] = describe_period(timeframe)
+        return result
+
+    def server_stats(self, request):
+        return {
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "appends": self.appends,
+            "price_cache": {
+                "price_return": returns.get_price_cache().stats(),
+                "investment_return": investment_returns.get_price_cache().stats(),
+            },
+            "result_cache": investment_returns.get_result_cache().stats(),
+            "stale_customers": self.stale_customers,
+            "methods": {method: stats.summary() for method, stats in self.stats.items()},
+        }
+
+    def handle(self, request):
+        methods = {
+            "price_return": self.price_return,
+            "investment_return": self.investment_return,
+            "stats": self.server_stats,
+        }
+        # Anything but a string would fail the lookups below with a TypeError
+        for field in ("method", "ticker", "customer_id"):
+            if field in request and not isinstance(request[field], str):
+                return {"id": request.get("id"), "ok": False, "error": f"{field} must be a string"}
+        method = request.get("method")
+        if method not in methods:
+            return {"id": request.get("id"), "ok": False, "error": f"unknown method {method}"}
+
+        start = time.perf_counter()
+        try:
+            response = {"id": request.get("id"), "ok": True, "result": methods[method](request)}
+        except ValueError as error:
+            response = {"id": request.get("id"), "ok": False, "error": str(error)}
+        if method != "stats":
+            self.stats.setdefault(method, LatencyStats()).record(time.perf_counter() - start, response["ok"])
+        return response
+
+    async def serve_client(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request must be a JSON object")
+                except ValueError as error:
+                    response = {"id": None, "ok": False, "error": f"bad request: {error}"}
+                else:
+                    response = self.handle(request)
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host=None, port=None, unix_path=None):
+        self.install(await asyncio.to_thread(load_dataset))
+        if unix_path:
+            server = await asyncio.start_unix_server(self.serve_client, path=unix_path)
+        else:
+            server = await asyncio.start_server(self.serve_client, host=host, port=port)
+        return server
+
+    async def run(self, host=None, port=None, unix_path=None):
+        server = await self.start(host, port, unix_path)
+        watcher = asyncio.create_task(self.watch_sources())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Price and investment return query server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="Listen on a Unix socket instead of TCP")
+    parser.add_argument("--reload-interval", type=float, default=2.0,
+                        help="Seconds between checks for changed CSVs")
+    parser.add_argument("--price-cache-size", type=int, default=4096,
+                        help="Resolved (ticker, start, end) prices kept per method")
+    parser.add_argument("--result-cache-size", type=int, default=65536,
+                        help="Investment results kept per (customer, start, end)")
+    args = parser.parse_args()
+    returns.PRICE_CACHE_SIZE = args.price_cache_size
+    investment_returns.PRICE_CACHE_SIZE = args.price_cache_size
+    investment_returns.RESULT_CACHE_SIZE = args.result_cache_size
+
+    server = ReturnsServer(args.reload_interval)
+    print(f"Serving on {args.unix or f'{args.host}:{args.port}'}")
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(server.run(args.host, args.port, args.unix))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Rolling price returns for every trading day of every ETF
+For each ticker the whole close series is handled in one NumPy pass per
+window: each trading day is an end date, its start close is found with
+searchsorted using the same last close on or before rule as returns.py,
+and splits come from the cumulative split tables
+Rows are written a ticker at a time, so only one ticker's series is in
+memory however long the history
+Usage: python rolling_returns.py --output rolling.csv
+       python rolling_returns.py --ticker NDQ --timeframe '1 year'
+"""
+import argparse
+import csv
+import sys
+from datetime import date
+
+import numpy as np
+
+import corporate_actions
+import returns
+from periods import TIMEFRAMES
+
+
+def return_column(timeframe):
+    return "return_" + timeframe.replace(" ", "_")
+
+
+def ticker_series(actions, ticker):
+    prices = actions.prices_for(ticker)
+    return (np.asarray(prices.dates(ticker), dtype=np.int64),
+            np.asarray(prices.closes(ticker), dtype=np.float64))
+
+
+def adjust_start_prices(actions, ticker, start_prices, start_ordinals, end_ordinals):
+    # Vector form of the handle_split_calculation loop, splits strictly between start and end
+    return start_prices / actions.split_factors(ticker, start_ordinals, end_ordinals, include_through=False)
+
+
+def rolling_returns(actions, ticker, timeframes):
+    """
+    Day ordinals of ticker's closes and, per timeframe, the return ending on
+    each of them; NaN where the window starts before the first close
+    """
+    day_ordinals, closes = ticker_series(actions, ticker)
+    series = {}
+    for timeframe in timeframes:
+        start_index = np.searchsorted(day_ordinals, day_ordinals - TIMEFRAMES[timeframe], side="right") - 1
+        found = start_index >= 0
+        start_index = np.maximum(start_index, 0)
+        start_prices = adjust_start_prices(actions, ticker, closes[start_index], day_ordinals[start_index],
+                                           day_ordinals)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            series[timeframe] = np.where(found, (closes / start_prices - 1) * 100, np.nan)
+    return day_ordinals, series
+
+
+def write_rolling_returns(actions, tickers, timeframes, output_file):
+    writer = csv.writer(output_file)
+    writer.writerow(["date", "ticker"] + [return_column(timeframe) for timeframe in timeframes])
+    date_strs = {}
+    rows = 0
+    for ticker in tickers:
+        day_ordinals, series = rolling_returns(actions, ticker, timeframes)
+        columns = [[value if value == value else "" for value in series[timeframe].tolist()]
+                   for timeframe in timeframes]
+        day_strs = []
+        for day_ordinal in day_ordinals.tolist():
+            if day_ordinal not in date_strs:
+                date_strs[day_ordinal] = date.fromordinal(day_ordinal).isoformat()
+            day_strs.append(date_strs[day_ordinal])
+        writer.writerows(zip(day_strs, [ticker] * len(day_strs), *columns))
+        rows += len(day_strs)
+    return rows
+
+
+def load_actions():
+    # Same inputs as returns.py, so ticker changes and splits resolve the same way
+    returns.read_inputs()
+    return corporate_actions.CorporateActions(returns.price_data, returns.splits_data, returns.ticker_changes_data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rolling price returns for every trading day")
+    parser.add_argument("--ticker", action="append", dest="tickers",
+                        help="Ticker to include, repeatable (default: all)")
+    parser.add_argument("--timeframe", action="append", choices=list(TIMEFRAMES), dest="timeframes",
+                        help="Window to calculate, repeatable (default: all)")
+    parser.add_argument("--output", help="Output CSV file (default: stdout)")
+    args = parser.parse_args()
+
+    actions = load_actions()
+    tickers = args.tickers or actions.price_data.tickers()
+    unknown = [ticker for ticker in tickers if ticker not in actions.price_data]
+    if unknown:
+        print(f"Unknown ticker {unknown[0]}")
+        sys.exit(1)
+    timeframes = args.timeframes or list(TIMEFRAMES)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as output_file:
+            write_rolling_returns(actions, tickers, timeframes, output_file)
+    else:
+        write_rolling_returns(actions, tickers, timeframes, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Binary snapshot cache for parsed input files
+After the first run the parsed structure for each CSV is pickled to
+.snapshot_cache/ together with the source's size, mtime and sha256
+Later runs mmap the snapshot and unpickle it instead of parsing the CSV
+A snapshot is reused while size and mtime match, or when they changed
+but the content hash didn't; otherwise the CSV is parsed again
+When the file only grew and the bytes before the old end are unchanged
+(checked on the last few KB), readers that can append parse just the new
+tail into the snapshot's data instead
+"""
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+
+CACHE_DIR = ".snapshot_cache"
+FORMAT_VERSION = 6
+# Bytes before the old end of file compared to tell an append from a rewrite
+TAIL_BYTES = 4096
+# Magic, format version and header length
+PREFIX = struct.Struct("<8sIQ")
+MAGIC = b"ETFSNAP\0"
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as source_file:
+        for block in iter(lambda: source_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def snapshot_path(source_path, name):
+    return os.path.join(CACHE_DIR, f"{name}.{os.path.basename(source_path)}.snapshot")
+
+
+def tail_fingerprint(path, end):
+    with open(path, "rb") as source_file:
+        source_file.seek(max(0, end - TAIL_BYTES))
+        return hashlib.sha256(source_file.read(min(end, TAIL_BYTES))).hexdigest()
+
+
+def source_header(source_path, hash_contents=True):
+    stat = os.stat(source_path)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        # An appended snapshot skips the full hash, it only matters for touched files
+        "sha256": file_hash(source_path) if hash_contents else None,
+        "tail": tail_fingerprint(source_path, stat.st_size),
+    }
+
+
+def header_matches(header, source_path):
+    stat = os.stat(source_path)
+    if header["size"] != stat.st_size:
+        return False
+    if header["mtime_ns"] == stat.st_mtime_ns:
+        return True
+    # Touched but maybe not changed
+    return header["sha256"] is not None and header["sha256"] == file_hash(source_path)
+
+
+def appended_to(header, source_path):
+    # True when source_path is the file header was taken from with rows added at the end
+    return (os.stat(source_path).st_size > header["size"]
+            and tail_fingerprint(source_path, header["size"]) == header["tail"])
+
+
+def read_snapshot(path, wanted):
+    # (header, data) when wanted(header) is true, None if not or there's no usable snapshot
+    try:
+        with open(path, "rb") as snapshot_file, \
+                mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            magic, version, header_length = PREFIX.unpack_from(mapped)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                return None
+            header = pickle.loads(mapped[PREFIX.size:PREFIX.size + header_length])
+            if not wanted(header):
+                return None
+            view = memoryview(mapped)[PREFIX.size + header_length:]
+            try:
+                return header, pickle.loads(view)
+            finally:
+                view.release()
+    except (OSError, ValueError, struct.error, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def read_header(path):
+    # The snapshot's header without unpickling its data, None if there's no usable snapshot
+    try:
+        with open(path, "rb") as snapshot_file:
+            magic, version, header_length = PREFIX.unpack(snapshot_file.read(PREFIX.size))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                return None
+            return pickle.loads(snapshot_file.read(header_length))
+    except (OSError, ValueError, struct.error, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def snapshot_usable(source_path, name):
+    # True when cached_read can start from the snapshot, as is or by appending the new tail
+    header = read_header(snapshot_path(source_path, name))
+    return header is not None and (header_matches(header, source_path) or appended_to(header, source_path))
+
+
+def load_snapshot(path, source_path):
+    # Returns the cached data, None if there's no usable snapshot
+    snapshot = read_snapshot(path, lambda header: header_matches(header, source_path))
+    return snapshot[1] if snapshot else None
+
+
+def save_snapshot(path, header, data):
+    header = pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, "wb") as snapshot_file:
+            snapshot_file.write(PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+            snapshot_file.write(header)
+            pickle.dump(data, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    except OSError:
+        # Caching is best effort, a read only directory just means no cache
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def cached_read(source_path, read_function, name, enabled=True, append_function=None):
+    """
+    read_function() parses source_path; name keeps snapshots of different
+    parsers for the same file apart
+    append_function(data, source_path, offset), if given, adds the rows
+    after byte offset to data in place
+    """
+    if not enabled:
+        return read_function()
+    path = snapshot_path(source_path, name)
+    data = load_snapshot(path, source_path)
+    if data is not None:
+        return data
+
+    if append_function is not None:
+        # Signature taken before reading the tail, rows added meanwhile are read again next time
+        header = source_header(source_path, hash_contents=False)
+        snapshot = read_snapshot(path, lambda old_header: appended_to(old_header, source_path))
+        if snapshot is not None:
+            old_header, data = snapshot
+            append_function(data, source_path, old_header["size"])
+            save_snapshot(path, header, data)
+            return data
+
+    # Signature taken before parsing so a file changing mid-read isn't cached as current
+    header = source_header(source_path)
+    data = read_function()
+    save_snapshot(path, header, data)
+    return data
@@ -4,10 +4,30 @@ Also includes tests for Investment returns functions
 Usage: python -m unittest tests.py
 """
 
+import asyncio
+import json
+import os
+import tempfile
 import unittest
+from datetime import date
+from unittest import mock
 
 from returns import get_prices_for_period, calc_price_return, sort_dates, unittest_setup
-from investment_returns import get_ticker_prices_for_timeframe, get_invest_return, unittest_setup as investment_unittest_setup
+from investment_returns import get_ticker_prices_for_timeframe, get_invest_return, iter_batch_results, unittest_setup as investment_unittest_setup
+from corporate_actions import CorporateActions, linked_tickers
+from mapped_prices import convert_prices, open_mapped_prices
+from periods import parse_period
+from portfolio_store import PortfolioStore
+from ingest import FastParseError, iter_price_series
+from price_store import PriceStore, read_price_store, read_price_store_csv
+from result_cache import LRUCache
+from trading_calendar import SharedCalendar, TradingCalendar
+import snapshot_cache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class TestReturns(unittest.TestCase):
 
@@ -116,15 +136,15 @@ class TestReturns(unittest.TestCase):
         investment_returns.portfolio_data = {}
 
         # Test data
-        investment_returns.price_data = {
+        investment_returns.price_data = PriceStore.from_dict({
             "TEST": {
                 "2023-12-31": "100",
                 "2024-12-31": "110",
             }
-        }
+        })
         investment_returns.splits_data = {}
         investment_returns.ticker_changes_data = {}
-        investment_returns.portfolio_data = {
+        investment_returns.portfolio_data = PortfolioStore.from_dict({
             "TEST001": {
                 "TEST": [
                     {
@@ -134,7 +154,7 @@ class TestReturns(unittest.TestCase):
                     }
                 ]
             }
-        }
+        })
 
         customer_id = "TEST001"
         timeframe = "1 year"
@@ -165,15 +185,15 @@ class TestReturns(unittest.TestCase):
         investment_returns.portfolio_data = {}
 
         # Test data
-        investment_returns.price_data = {
+        investment_returns.price_data = PriceStore.from_dict({
             "TEST": {
                 "2023-12-31": "100",
                 "2024-12-31": "110",
             }
-        }
+        })
         investment_returns.splits_data = {}
         investment_returns.ticker_changes_data = {}
-        investment_returns.portfolio_data = {
+        investment_returns.portfolio_data = PortfolioStore.from_dict({
             "TEST002": {
                 "TEST": [
                     {
@@ -188,7 +208,7 @@ class TestReturns(unittest.TestCase):
                     },
                 ]
             }
-        }
+        })
 
         customer_id = "TEST002"
         timeframe = "1 year"
@@ -220,19 +240,19 @@ class TestReturns(unittest.TestCase):
         investment_returns.portfolio_data = {}
 
         # Test data
-        investment_returns.price_data = {
+        investment_returns.price_data = PriceStore.from_dict({
             "TEST": {
                 "2023-12-31": "100",
                 "2024-12-31": "55",
             }
-        }
+        })
         investment_returns.splits_data = {
             "TEST": {
                 "01/06/2024": ["1", "2"], 
             }
         }
         investment_returns.ticker_changes_data = {}
-        investment_returns.portfolio_data = {
+        investment_returns.portfolio_data = PortfolioStore.from_dict({
             "TEST003": {
                 "TEST": [
                     {
@@ -242,7 +262,7 @@ class TestReturns(unittest.TestCase):
                     }
                 ]
             }
-        }
+        })
         customer_id = "TEST003"
         timeframe = "1 year"
 
@@ -270,20 +290,20 @@ class TestReturns(unittest.TestCase):
         investment_returns.portfolio_data = {}
 
         # Test data
-        investment_returns.price_data = {
+        investment_returns.price_data = PriceStore.from_dict({
             "OLD": {
                 "2023-12-31": "100",
             },
             "NEW": {
                 "2024-12-31": "110",
             },
-        }
+        })
         investment_returns.splits_data = {}
         investment_returns.ticker_changes_data = {
             "OLD": [["01/06/2024", "NEW"]],
-            "NEW": [["01/06/2024", "OLD"]],
+            "NEW": [],
         }
-        investment_returns.portfolio_data = {
+        investment_returns.portfolio_data = PortfolioStore.from_dict({
             "TEST004": {
                 "OLD": [
                     {
@@ -293,7 +313,7 @@ class TestReturns(unittest.TestCase):
                     }
                 ]
             }
-        }
+        })
         customer_id = "TEST004"
         timeframe = "1 year"
 
@@ -309,5 +329,639 @@ class TestReturns(unittest.TestCase):
         self.assertAlmostEqual(actual_dollar_return, expected_dollar_return, places=2)
 
 
+class TestPeriods(unittest.TestCase):
+
+    def test_date_range_matches_timeframe(self):
+        unittest_setup()
+        named = get_prices_for_period("A123", "1 year")
+        self.assertEqual(get_prices_for_period("A123", parse_period("2024-01-01", "2024-12-31")), named)
+        self.assertEqual(get_prices_for_period("A123", parse_period("1 year", "2024-12-31")), named)
+        import returns
+        self.assertEqual(returns.get_price_cache().stats()["hits"], 2) # Same dates, same cache entry
+        self.assertRaises(ValueError, parse_period, "2024-09-30", "2024-03-14")
+
+    def test_lru_cache(self):
+        cache = LRUCache(maxsize=2)
+        cache["a"] = 1
+        cache["b"] = 2
+        self.assertEqual(cache.get("a"), 1) # a is now the most recent
+        cache["c"] = 3
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats(), {"size": 2, "maxsize": 2, "hits": 1, "misses": 1, "evictions": 1,
+                                         "hit_rate": 0.5})
+
+
+class TestRollingReturns(unittest.TestCase):
+
+    @unittest.skipIf(numpy is None, "NumPy not installed")
+    def test_rolling_matches_single_period(self):
+        import returns
+        import rolling_returns
+        from datetime import timedelta
+        unittest_setup()
+        actions = returns.get_corporate_actions()
+        for ticker in ["A123", "CYBR", "NDQ"]:
+            day_ordinals, series = rolling_returns.rolling_returns(actions, ticker, ["5 days", "1 year"])
+            for day_ordinal, one_year in zip(day_ordinals.tolist(), series["1 year"].tolist()):
+                end_date = date.fromordinal(day_ordinal)
+                if one_year != one_year: # Window starts before the first close
+                    self.assertIsNone(actions.close_on_or_before(ticker, end_date - timedelta(days=365)))
+                    continue
+                with mock.patch("builtins.print"):
+                    end_price, start_price = get_prices_for_period(ticker, (end_date - timedelta(days=365), end_date))
+                self.assertEqual(one_year, calc_price_return(end_price, start_price))
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_batch_matches_single_run(self):
+        # CUST002 holds A200 which split during the year
+        investment_unittest_setup()
+        single = {}
+        for timeframe in ["1 day", "1 year"]:
+            investment_unittest_setup()
+            ticker_prices = get_ticker_prices_for_timeframe("CUST002", timeframe)
+            single[timeframe] = get_invest_return(ticker_prices, "CUST002")
+
+        investment_unittest_setup()
+        results = list(iter_batch_results(["CUST002", "MISSING"], ["1 day", "1 year"]))
+        self.assertEqual(len(results), 4)
+        for result in results[:2]:
+            expected = single[result["timeframe"]]
+            self.assertAlmostEqual(result["start_total"], expected["start_total"], places=6)
+            self.assertAlmostEqual(result["current_total"], expected["current_total"], places=6) # Split applied once per timeframe
+            self.assertAlmostEqual(result["contribution_total"], expected["contribution_total"], places=6)
+        self.assertEqual(results[2]["error"], "unknown customer")
+
+    def test_parallel_matches_serial(self):
+        import investment_returns
+        import parallel_returns
+
+        investment_unittest_setup()
+        customer_ids = list(investment_returns.portfolio_data) + ["MISSING"]
+        timeframes = ["5 days", "1 year"]
+        serial = list(iter_batch_results(customer_ids, timeframes))
+        parallel = list(parallel_returns.iter_parallel_results(investment_returns, customer_ids, timeframes,
+                                                               workers=2, chunk_size=2))
+        self.assertEqual(parallel, serial) # Same rows in the same order
+
+    def test_ticker_batch_matches_single_run(self):
+        import returns
+
+        unittest_setup()
+        results = returns.iter_batch_results(["NDQ", "A123", "MISSING"], ["5 days", "6 months"], as_of="2024-09-30")
+        rows = returns.sort_batch_results(results, "return_percentage", descending=True)
+        self.assertEqual([row["error"] for row in rows[-2:]], ["unknown ticker"] * 2) # Errors sort last
+        for row in rows[:-2]:
+            with mock.patch("builtins.print"):
+                end_price, start_price = get_prices_for_period(row["ticker"], parse_period(row["timeframe"], "2024-09-30"))
+            self.assertEqual(row["return_percentage"], calc_price_return(end_price, start_price))
+        self.assertGreaterEqual(rows[0]["return_percentage"], rows[1]["return_percentage"])
+
+    @unittest.skipIf(numpy is None, "vector engine needs numpy")
+    def test_vector_matches_scalar(self):
+        import investment_returns
+        import vector_returns
+
+        investment_unittest_setup()
+        customer_ids = list(investment_returns.portfolio_data) + ["MISSING"]
+        timeframes = list(investment_returns.TIMEFRAMES)
+        vector = list(vector_returns.iter_vector_results(investment_returns, customer_ids, timeframes))
+        investment_unittest_setup()
+        scalar = list(iter_batch_results(customer_ids, timeframes))
+        self.assertEqual(len(vector), len(scalar))
+        for vector_row, scalar_row in zip(vector, scalar):
+            self.assertEqual(vector_row.keys(), scalar_row.keys())
+            for field, value in scalar_row.items():
+                if isinstance(value, float):
+                    self.assertAlmostEqual(vector_row[field], value, places=6)
+                else:
+                    self.assertEqual(vector_row[field], value)
+
+
+class TestReturnMethods(unittest.TestCase):
+
+    @unittest.skipIf(numpy is None, "return methods need numpy")
+    def test_twr_and_xirr(self):
+        """
+        - Both customers had 10 shares at start at $100, the price rises 20% then 10%
+        - TEST002 bought 5 more shares at $120 half way through
+        - TWR ignores the purchase, XIRR weighs the second half more
+        """
+        import investment_returns
+        import return_methods
+
+        investment_returns.price_data = PriceStore.from_dict({
+            "TEST": {"2023-12-31": "100", "2024-07-01": "120", "2024-12-31": "132"}
+        })
+        investment_returns.splits_data = {}
+        investment_returns.ticker_changes_data = {}
+        start_lot = {"purchase_date": "2023-06-01", "shares_qty": "10", "cost_basis": "100"}
+        investment_returns.portfolio_data = PortfolioStore.from_dict({
+            "TEST001": {"TEST": [start_lot]},
+            "TEST002": {"TEST": [start_lot, {"purchase_date": "2024-07-01", "shares_qty": "5", "cost_basis": "120"}]},
+        })
+
+        held, bought = return_methods.iter_method_results(investment_returns, ["TEST001", "TEST002"], ["1 year"])
+        self.assertAlmostEqual(held["twr_percentage"], 32.0, places=6)
+        self.assertAlmostEqual(held["xirr_percentage"], 32.0, places=6)
+        self.assertAlmostEqual(bought["twr_percentage"], 32.0, places=6)
+        self.assertAlmostEqual(bought["current_total"], 1980.0, places=6)
+        rate = bought["xirr_percentage"] / 100
+        remaining_years = (date(2024, 12, 31) - date(2024, 7, 1)).days / 365
+        self.assertAlmostEqual(1000 * (1 + rate) + 600 * (1 + rate) ** remaining_years, 1980.0, places=6)
+        self.assertLess(rate, 0.32)
+
+    @unittest.skipIf(numpy is None, "return methods need numpy")
+    def test_lot_bought_after_start_close(self):
+        """
+        - The period starts on a holiday, resolving to the 2023-12-29 close
+        - A lot bought on 2023-12-30 is a contribution to every method, as in get_invest_return
+        """
+        import investment_returns
+        import return_methods
+
+        investment_returns.price_data = PriceStore.from_dict({"TEST": {"2023-12-29": "100", "2024-12-31": "120"}})
+        investment_returns.splits_data = {}
+        investment_returns.ticker_changes_data = {}
+        investment_returns.portfolio_data = PortfolioStore.from_dict({"TEST001": {"TEST": [
+            {"purchase_date": "2023-06-01", "shares_qty": "10", "cost_basis": "100"},
+            {"purchase_date": "2023-12-30", "shares_qty": "10", "cost_basis": "100"},
+        ]}})
+
+        result, = return_methods.iter_method_results(investment_returns, ["TEST001"], ["1 year"])
+        self.assertAlmostEqual(result["start_total"], 1000.0, places=6)
+        self.assertAlmostEqual(result["contribution_total"], 1000.0, places=6)
+        self.assertAlmostEqual(result["return_percentage"], 40.0, places=6)
+        self.assertAlmostEqual(result["twr_percentage"], 40.0, places=6)
+        rate = result["xirr_percentage"] / 100
+        flow_years = (date(2024, 12, 31) - date(2023, 12, 30)).days / 365
+        self.assertAlmostEqual(1000 * (1 + rate) + 1000 * (1 + rate) ** flow_years, 2400.0, places=6)
+
+
+    @unittest.skipIf(numpy is None, "daily values need numpy")
+    def test_daily_values(self):
+        """
+        - 10 shares at start at $100, a 2 to 1 split on 2024-06-01
+        - TEST002 bought 4 more shares at $60 after the split
+        - TEST003 holds a ticker with no price at the start
+        """
+        import csv
+        import io
+        import daily_values
+        import investment_returns
+        from vector_returns import LotArrays
+
+        investment_returns.price_data = PriceStore.from_dict({
+            "TEST": {"2023-12-31": "100", "2024-06-03": "60", "2024-12-31": "55"},
+            "LATE": {"2024-03-01": "10", "2024-12-31": "11"},
+        })
+        investment_returns.splits_data = {"TEST": {"01/06/2024": ["1", "2"]}}
+        investment_returns.ticker_changes_data = {}
+        start_lot = {"purchase_date": "2023-06-01", "shares_qty": "10", "cost_basis": "100"}
+        investment_returns.portfolio_data = PortfolioStore.from_dict({
+            "TEST001": {"TEST": [start_lot]},
+            "TEST002": {"TEST": [start_lot, {"purchase_date": "2024-06-03", "shares_qty": "4", "cost_basis": "60"}]},
+            "TEST003": {"LATE": [{"purchase_date": "2024-03-01", "shares_qty": "1", "cost_basis": "10"}]},
+        })
+
+        output_file = io.StringIO()
+        lots = LotArrays(investment_returns.portfolio_data)
+        daily_values.write_daily_values(investment_returns, lots, "1 year", output_file)
+        rows = list(csv.reader(io.StringIO(output_file.getvalue())))
+        self.assertEqual(rows[0], ["customer_id", "2024-01-01", "2024-03-01", "2024-06-03", "2024-12-31", "error"])
+        self.assertEqual(rows[1], ["TEST001", "1000.00", "1000.00", "1200.00", "1100.00", ""])
+        self.assertEqual(rows[2], ["TEST002", "1000.00", "1000.00", "1440.00", "1320.00", ""])
+        self.assertEqual(rows[3], ["TEST003", "", "", "", "", "requested period for LATE not found"])
+
+    @unittest.skipIf(numpy is None, "daily values need numpy")
+    def test_daily_values_start_on_resolved_close(self):
+        """
+        - The period starts on a holiday, resolving to the 2023-12-29 close
+        - A lot bought on 2023-12-30 isn't in the start value, as in get_invest_return
+        """
+        import csv
+        import io
+        import daily_values
+        import investment_returns
+        from vector_returns import LotArrays
+
+        investment_returns.price_data = PriceStore.from_dict({"TEST": {"2023-12-29": "100", "2024-12-31": "120"}})
+        investment_returns.splits_data = {}
+        investment_returns.ticker_changes_data = {}
+        investment_returns.portfolio_data = PortfolioStore.from_dict({"TEST001": {"TEST": [
+            {"purchase_date": "2023-06-01", "shares_qty": "10", "cost_basis": "100"},
+            {"purchase_date": "2023-12-30", "shares_qty": "10", "cost_basis": "100"},
+        ]}})
+
+        output_file = io.StringIO()
+        daily_values.write_daily_values(investment_returns, LotArrays(investment_returns.portfolio_data), "1 year",
+                                        output_file)
+        rows = list(csv.reader(io.StringIO(output_file.getvalue())))
+        return_total = get_invest_return(get_ticker_prices_for_timeframe("TEST001", "1 year"), "TEST001")
+        self.assertEqual(rows[1], ["TEST001", "1000.00", "2400.00", ""])
+        self.assertEqual(rows[1][1:3], ["%.2f" % return_total["start_total"], "%.2f" % return_total["current_total"]])
+
+
+class TestPriceStore(unittest.TestCase):
+
+    def test_close_on_or_before(self):
+        store = PriceStore.from_dict({
+            "TEST": {
+                "2024-01-05": "12.5",
+                "2024-01-02": "10",
+                "2024-01-03": "11",
+            }
+        })
+        # Rows out of order are sorted once on first lookup
+        self.assertEqual(list(store.closes("TEST")), [10.0, 11.0, 12.5])
+        self.assertEqual(store.close_on_or_before("TEST", date(2024, 1, 3)), (date(2024, 1, 3), 11.0))
+        self.assertEqual(store.close_on_or_before("TEST", date(2024, 1, 4)), (date(2024, 1, 3), 11.0))
+        self.assertIsNone(store.close_on_or_before("TEST", date(2024, 1, 1)))
+
+    def test_closes_on_or_before_after_append(self):
+        store = PriceStore.from_dict({
+            "FULL": {"2024-01-02": "10", "2024-01-03": "11", "2024-01-04": "12"},
+            "GAPPY": {"2024-01-02": "20", "2024-01-04": "22"},
+        })
+        shared = store._shared
+        full_run = shared._runs["FULL"]
+        # GAPPY changes after the shared calendar was built and falls back to its own
+        store.add("GAPPY", date(2024, 1, 3).toordinal(), 21.0)
+        closes = store.closes_on_or_before(["FULL", "GAPPY"], date(2024, 1, 3))
+        self.assertEqual(closes, {"FULL": (date(2024, 1, 3), 11.0), "GAPPY": (date(2024, 1, 3), 21.0)})
+        self.assertEqual(store.last_close_before("FULL", date(2024, 1, 3)), date(2024, 1, 2))
+        self.assertIsNone(store.last_close_before("GAPPY", date(2024, 1, 2)))
+        # Rebuilding the calendars puts it back on the shared one, updated in place
+        store.build_calendars()
+        self.assertIs(store._shared, shared)
+        self.assertIs(shared._runs["FULL"], full_run)
+        store.add("GAPPY", date(2024, 1, 8).toordinal(), 23.0)
+        store.build_calendars()
+        self.assertIs(store._shared, shared)
+        self.assertEqual(store.close_on_or_before("GAPPY", date(2024, 1, 9)), (date(2024, 1, 8), 23.0))
+        self.assertEqual(store.close_on_or_before("FULL", date(2024, 1, 9)), (date(2024, 1, 4), 12.0))
+        # A day inside the union can't be added in place, the calendar is built again
+        store.add("FULL", date(2024, 1, 5).toordinal(), 12.5)
+        store.build_calendars()
+        self.assertIsNot(store._shared, shared)
+        self.assertEqual(store.close_on_or_before("GAPPY", date(2024, 1, 5)), (date(2024, 1, 4), 22.0))
+        with mock.patch.object(store, "calendar", side_effect=AssertionError("per ticker calendar used")):
+            closes = store.closes_on_or_before(["FULL", "GAPPY"], date(2024, 1, 3))
+        self.assertEqual(closes, {"FULL": (date(2024, 1, 3), 11.0), "GAPPY": (date(2024, 1, 3), 21.0)})
+
+    def test_corporate_actions_view(self):
+        store = PriceStore.from_dict({
+            "OLD": {"2024-01-02": "10", "2024-01-03": "11"},
+            "NEW": {"2024-01-03": "11.5", "2024-01-04": "12"},
+        })
+        changes = {"OLD": [["03/01/2024", "NEW"]], "NEW": []}
+        splits = {"NEW": {"04/01/2024": ["1", "2"]}}
+        actions = CorporateActions(store, splits, changes)
+        # The new ticker's closes from the effective date on
+        self.assertEqual(actions.close_on_or_before("OLD", date(2024, 1, 3)), (date(2024, 1, 3), 11.5))
+        self.assertEqual(actions.close_on_or_before("OLD", date(2024, 1, 5)), (date(2024, 1, 4), 12.0))
+        self.assertEqual(list(store.closes("OLD")), [10.0, 11.0]) # Underlying store untouched
+        # Lots bought under the old ticker still get the new ticker's split
+        self.assertEqual(actions.position_split_ratio("OLD", date(2024, 1, 2), date(2024, 1, 5)), 2.0)
+        self.assertEqual(actions.position_split_ratio("OLD", date(2024, 1, 4), date(2024, 1, 5)), 1.0)
+
+    def test_ticker_change_chain(self):
+        store = PriceStore.from_dict({
+            "AAA": {"2024-01-02": "10", "2024-01-03": "11"},
+            "BBB": {"2024-02-01": "20", "2024-02-02": "21"},
+            # CCC's history was back-filled over a day AAA traded
+            "CCC": {"2024-01-02": "9.5", "2024-03-01": "30"},
+        })
+        # AAA to BBB to CCC, under the old tickers like read_ticker_changes_input, with the later change first
+        changes = {
+            "BBB": [["01/03/2024", "CCC"]],
+            "CCC": [],
+            "AAA": [["01/02/2024", "BBB"]],
+        }
+        actions = CorporateActions(store, {"AAA": {"03/01/2024": ["1", "2"]}}, changes)
+        self.assertEqual(actions.instruments, {"CCC": ("AAA", "BBB", "CCC")})
+        self.assertEqual(actions.aka_tickers("CCC"), ["AAA", "BBB", "CCC"])
+        for ticker in ("AAA", "BBB", "CCC"):
+            # Each ticker's closes only count while it was the active one
+            self.assertEqual(actions.close_on_or_before(ticker, date(2024, 1, 2)), (date(2024, 1, 2), 10.0))
+            self.assertEqual(actions.close_on_or_before(ticker, date(2024, 2, 29)), (date(2024, 2, 2), 21.0))
+            self.assertEqual(actions.close_on_or_before(ticker, date(2024, 3, 5)), (date(2024, 3, 1), 30.0))
+        self.assertEqual(actions.position_split_ratio("CCC", date(2024, 1, 2), date(2024, 3, 1)), 2.0)
+        self.assertEqual(actions.dependent_tickers({"AAA"}), {"AAA", "BBB", "CCC"})
+        self.assertEqual(linked_tickers(changes, ["CCC", "OTHER"]), {"AAA", "BBB", "CCC", "OTHER"})
+        # The old bidirectional layout, each change under both tickers, is refused rather than guessed at
+        both_ways = {"AAA": [["01/02/2024", "BBB"]], "BBB": [["01/02/2024", "AAA"]]}
+        self.assertRaises(ValueError, CorporateActions, store, {}, both_ways)
+
+    def test_split_factor(self):
+        splits = {"TEST": {"01/06/2024": ["1", "2"], "01/02/2024": ["1", "3"], "01/09/2024": ["2", "1"]}}
+        actions = CorporateActions(PriceStore(), splits, {})
+        june = date(2024, 6, 1).toordinal()
+        self.assertEqual(actions.split_factor("TEST", date(2024, 1, 1).toordinal(), date(2024, 12, 31).toordinal()), 3.0)
+        self.assertEqual(actions.split_factor("TEST", date(2024, 3, 1).toordinal(), june), 2.0)
+        self.assertEqual(actions.split_factor("TEST", date(2024, 3, 1).toordinal(), june, include_through=False), 1.0)
+        self.assertEqual(actions.split_factor("OTHER", 0, june), 1.0)
+
+    @unittest.skipIf(numpy is None, "split_factors needs numpy")
+    def test_split_factors_match_split_factor(self):
+        splits = {"TEST": {"01/06/2024": ["1", "2"], "01/02/2024": ["1", "3"], "01/09/2024": ["2", "1"]}}
+        actions = CorporateActions(PriceStore(), splits, {})
+        days = [date(2024, month, day).toordinal() for month in range(1, 13) for day in (1, 15)]
+        for include_through in (True, False):
+            factors = actions.split_factors("TEST", days[0], days, include_through).tolist()
+            self.assertEqual(factors, [actions.split_factor("TEST", days[0], day, include_through) for day in days])
+        self.assertEqual(actions.split_factors("OTHER", days, days[-1]).tolist(), [1.0] * len(days))
+
+    def test_filtered_ingestion(self):
+        store = read_price_store("prices.csv", {"HACK", "NDQ"}, date(2024, 6, 1), date(2024, 6, 30))
+        full = read_price_store("prices.csv")
+        self.assertEqual(sorted(store.tickers()), ["HACK", "NDQ"])
+        for ticker in store.tickers():
+            kept = [(day, close) for day, close in zip(full.dates(ticker), full.closes(ticker))
+                    if date(2024, 6, 1).toordinal() <= day <= date(2024, 6, 30).toordinal()]
+            self.assertEqual(list(zip(store.dates(ticker), store.closes(ticker))), kept)
+
+    @unittest.skipIf(numpy is None, "numpy not installed")
+    def test_fast_parser_matches_csv_reader(self):
+        lines = ["date,ticker,close_price", "2024-01-03,AAA,10.5", "2024-01-02,BBB,-0.25", "2024-01-02,AAA,.5",
+                 "2024-01-03,AAA,11", "2023-12-29,BBB,123456789.123456", "2024-02-29,CCC,7."]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "prices.csv")
+            for newline in ("\n", "\r\n"):
+                with open(path, "w", encoding="utf-8", newline="") as price_file:
+                    price_file.write(newline.join(lines))
+                for arguments in ((), ({"AAA", "BBB"}, date(2024, 1, 1), date(2024, 1, 31))):
+                    fast = read_price_store(path, *arguments)
+                    stream = read_price_store_csv(path, *arguments)
+                    self.assertEqual(fast.tickers(), stream.tickers())
+                    for ticker in stream.tickers():
+                        self.assertEqual(fast.dates(ticker), stream.dates(ticker))
+                        self.assertEqual(fast.closes(ticker), stream.closes(ticker))
+            # Carriage returns are left to the csv reader
+            with self.assertRaises(FastParseError):
+                list(iter_price_series(path))
+        fast = read_price_store("prices.csv")
+        stream = read_price_store_csv("prices.csv")
+        for ticker in stream.tickers():
+            self.assertEqual(fast.dates(ticker), stream.dates(ticker))
+            self.assertEqual(fast.closes(ticker), stream.closes(ticker))
+
+    def test_mapped_prices_match_csv(self):
+        with tempfile.TemporaryDirectory() as directory:
+            bin_path = os.path.join(directory, "prices.bin")
+            convert_prices("prices.csv", bin_path)
+            mapped = open_mapped_prices(bin_path, "prices.csv")
+            store = read_price_store("prices.csv")
+            self.assertEqual(mapped.tickers(), store.tickers())
+            for ticker in store.tickers():
+                self.assertEqual(list(mapped.dates(ticker)), list(store.dates(ticker)))
+                self.assertEqual(mapped.close_on_or_before(ticker, date(2024, 6, 8)),
+                                 store.close_on_or_before(ticker, date(2024, 6, 8)))
+            actions = CorporateActions(mapped, {}, {"CYBR": [["25/3/2024", "HACK"]]})
+            self.assertEqual(actions.close_on_or_before("CYBR", date(2024, 12, 31)), (date(2024, 12, 31), 14.02))
+            mapped.close()
+
+
+class TestPortfolioStore(unittest.TestCase):
+
+    def test_lots_grouped_by_customer_and_ticker(self):
+        store = PortfolioStore.from_chunks([[
+            ("CUST2", "AAA", "2024-01-02", "1", "10"),
+            ("CUST1", "BBB", "2024-01-03", "2", "20"),
+            ("CUST2", "BBB", "2024-01-04", "3", "30"),
+        ], [
+            ("CUST2", "AAA", "2024-01-05", "4", "40"),
+        ]])
+        self.assertEqual(list(store), ["CUST2", "CUST1"]) # First seen order, as the dict layout had
+        self.assertEqual(store.tickers_of("CUST2"), ["AAA", "BBB"])
+        holdings = [(ticker, [store.shares[lot] for lot in range(first, end)])
+                    for ticker, first, end in store.holdings("CUST2")]
+        self.assertEqual(holdings, [("AAA", [1.0, 4.0]), ("BBB", [3.0])])
+        _, first, _ = next(store.holdings("CUST1"))
+        self.assertEqual(store.purchase_dates[first], date(2024, 1, 3).toordinal())
+        self.assertEqual(store.cost_basis[first], 20.0)
+
+
+class TestTradingCalendar(unittest.TestCase):
+
+    def test_last_close(self):
+        friday = date(2024, 6, 7).toordinal()
+        monday = date(2024, 6, 10).toordinal()
+        calendar = TradingCalendar([friday, monday])
+
+        saturday = date(2024, 6, 8).toordinal()
+        self.assertEqual(calendar.last_close_on_or_before(saturday), friday) # Weekend resolves to Friday
+        self.assertEqual(calendar.last_close_on_or_before(monday), monday)
+        self.assertEqual(calendar.last_close_before(monday), friday) # Strictly before skips the same day
+        self.assertIsNone(calendar.last_close_before(friday))
+        self.assertIn(monday, calendar)
+        self.assertNotIn(saturday, calendar)
+
+    def test_shared_calendar_matches_per_ticker(self):
+        start = date(2024, 6, 3).toordinal()
+        full = [start + offset for offset in range(30) if offset % 7 < 5]
+        gappy = [day for day in full if day % 3][2:-4] # Missing days other tickers traded
+        shared = SharedCalendar({"FULL": full, "GAPPY": gappy})
+
+        for ticker, days in (("FULL", full), ("GAPPY", gappy)):
+            calendar = TradingCalendar(days)
+            for day in range(start - 2, start + 35):
+                self.assertEqual(shared.index_on_or_before(ticker, day), calendar.index_on_or_before(day))
+                self.assertEqual(shared.has_close(ticker, day), day in calendar)
+
+
+class TestReturnsServer(unittest.TestCase):
+
+    def test_requests(self):
+        from returns_server import ReturnsServer
+
+        async def query_server():
+            server = await ReturnsServer().start("127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            responses = []
+            for request in [
+                {"id": 1, "method": "price_return", "ticker": "A123", "timeframe": "1 year"},
+                {"id": 2, "method": "investment_return", "customer_id": "CUST002", "timeframe": "1 year"},
+                {"id": 3, "method": "investment_return", "customer_id": "CUST002", "timeframe": "1 year"},
+                {"id": 4, "method": "stats"},
+                {"id": 5, "method": "price_return", "ticker": ["A123"], "timeframe": "1 year"},
+                {"id": 6, "method": "price_return", "ticker": "A123", "start_date": "2000-01-03",
+                 "end_date": "2000-06-30"},
+            ]:
+                writer.write(json.dumps(request).encode("utf-8") + b"\n")
+                responses.append(json.loads(await reader.readline()))
+            # The server closes its end once it reads end of file, so no handler is left for asyncio.run to cancel
+            writer.write_eof()
+            self.assertEqual(await reader.read(), b"")
+            writer.close()
+            await writer.wait_closed()
+            server.close()
+            await server.wait_closed()
+            return responses
+
+        price, first, second, stats, bad_ticker, missing = asyncio.run(query_server())
+        self.assertAlmostEqual(price["result"]["start_price"], 126.93 / 5) # Same as test_split
+        self.assertEqual(first["result"], second["result"]) # Repeat queries don't double split
+        self.assertEqual(stats["result"]["methods"]["investment_return"]["count"], 2)
+        # One price lookup per ticker, the repeat query is answered by the result cache
+        import investment_returns
+        price_cache = stats["result"]["price_cache"]["investment_return"]
+        self.assertEqual((price_cache["hits"], price_cache["misses"]),
+                         (0, len(investment_returns.portfolio_data.tickers_of("CUST002"))))
+        self.assertEqual(stats["result"]["result_cache"]["hits"], 1)
+        self.assertEqual(bad_ticker["error"], "ticker must be a string")
+        self.assertEqual(missing["error"], "requested period for A123 not found")
+
+
+    def test_reload_recomputes_only_affected_customers(self):
+        import investment_returns
+        from returns_server import ReturnsServer, load_dataset
+
+        server = ReturnsServer()
+        dataset = load_dataset()
+        server.install(dataset)
+        customer_ids = list(investment_returns.portfolio_data)
+        request = {"method": "investment_return", "timeframe": "1 year"}
+        for customer_id in customer_ids:
+            server.handle(dict(request, customer_id=customer_id))
+
+        # A new split for NDQ only touches the customers holding it
+        splits_data = dict(dataset["splits_data"], NDQ={"1/10/2024": ["1", "2"]})
+        server.install(dict(dataset, splits_data=splits_data))
+        holders = investment_returns.portfolio_data.customers_holding("NDQ")
+        self.assertTrue(0 < len(holders) < len(customer_ids))
+        stats = server.server_stats({})
+        self.assertEqual(stats["stale_customers"], len(holders))
+        self.assertEqual(stats["result_cache"]["size"], len(customer_ids) - len(holders))
+        response = server.handle(dict(request, customer_id=holders[0]))
+        self.assertEqual(response["result"]["current_total"],
+                         investment_returns.evaluate_customer(holders[0], "1 year", {})["current_total"])
+
+        # A123 changed to A200, so correcting A123 touches the customers holding either
+        affected = investment_returns.invalidate_tickers(["A123"])
+        self.assertEqual(affected, set(investment_returns.portfolio_data.customers_holding("A123"))
+                         | set(investment_returns.portfolio_data.customers_holding("A200")))
+
+
+class TestTimings(unittest.TestCase):
+
+    def test_parse_options_and_instrument(self):
+        import types
+        import timings
+        argv, options = timings.parse_options(["CUST001", "--timings=out.json", "1 year", "--profile", "run.prof"])
+        self.assertEqual(argv, ["CUST001", "1 year"])
+        self.assertEqual(options, {"timings": "out.json", "profile": "run.prof"})
+
+        module = types.SimpleNamespace(double=lambda value: value * 2)
+        timings.instrument(module, ["double"])
+        self.assertEqual([module.double(1), module.double(2)], [2, 4])
+        self.assertEqual(timings.summary(1.0)["stages"]["double"]["calls"], 2)
+
+
+class TestSnapshotCache(unittest.TestCase):
+
+    def test_reuses_until_source_changes(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(snapshot_cache, "CACHE_DIR", os.path.join(directory, "cache")):
+            source_path = os.path.join(directory, "source.csv")
+            with open(source_path, "w", encoding="utf-8") as source_file:
+                source_file.write("a,b\n1,2\n")
+            reads = []
+
+            def read_source():
+                reads.append(source_path)
+                with open(source_path, encoding="utf-8") as source_file:
+                    return source_file.read().splitlines()
+
+            first = snapshot_cache.cached_read(source_path, read_source, "test")
+            second = snapshot_cache.cached_read(source_path, read_source, "test")
+            self.assertEqual(first, second)
+            self.assertEqual(len(reads), 1) # Second load came from the snapshot
+
+            with open(source_path, "a", encoding="utf-8") as source_file:
+                source_file.write("3,4\n")
+            third = snapshot_cache.cached_read(source_path, read_source, "test")
+            self.assertEqual(third, ["a,b", "1,2", "3,4"])
+            self.assertEqual(len(reads), 2) # Changed source was parsed again
+
+    def test_appended_prices_parse_only_the_tail(self):
+        import corporate_actions
+        from price_store import append_price_rows
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(snapshot_cache, "CACHE_DIR", os.path.join(directory, "cache")):
+            source_path = os.path.join(directory, "prices.csv")
+            with open(source_path, "w", encoding="utf-8") as source_file:
+                source_file.write("date,ticker,close_price\n2024-12-30,NDQ,40.00\n2024-12-31,NDQ,41.00")
+            snapshot_cache.cached_read(source_path, lambda: read_price_store(source_path), "test",
+                                       append_function=append_price_rows)
+            with open(source_path, "a", encoding="utf-8") as source_file:
+                source_file.write("\n2025-01-02,NDQ,42.00\n")
+
+            full_parse = mock.Mock(side_effect=AssertionError("full parse"))
+            store = snapshot_cache.cached_read(source_path, full_parse, "test", append_function=append_price_rows)
+            self.assertEqual(store.close_on_or_before("NDQ", date(2025, 1, 3)), (date(2025, 1, 2), 42.0))
+
+            # In place appends keep cached results that end before the new rows
+            splits, changes = {}, {}
+            price_cache = corporate_actions.view(store, splits, changes).cache("test", 10)
+            price_cache[("NDQ", 0, date(2024, 12, 31).toordinal())] = "kept"
+            price_cache[("NDQ", 0, date(2025, 1, 3).toordinal())] = "dropped"
+            store.add_rows([("NDQ", date(2025, 1, 3).toordinal(), 43.0)])
+            corporate_actions.refresh_prices(store, date(2025, 1, 3).toordinal(), {"NDQ"})
+            self.assertEqual(len(corporate_actions.view(store, splits, changes).cache("test", 10)), 1)
+
+    def test_append_keeps_untouched_calendars(self):
+        import corporate_actions
+        from price_store import append_price_rows
+        with tempfile.TemporaryDirectory() as directory:
+            source_path = os.path.join(directory, "prices.csv")
+            with open(source_path, "w", encoding="utf-8") as source_file:
+                source_file.write("date,ticker,close_price\n"
+                                  "2024-12-30,OLD,10.00\n2024-12-30,NDQ,40.00\n2024-12-30,LEFT,5.00\n"
+                                  "2024-12-31,NEW,11.00\n2024-12-31,NDQ,41.00\n2024-12-31,RIGHT,6.00\n")
+            offset = os.path.getsize(source_path)
+            store = read_price_store(source_path)
+            splits, changes = {}, {"OLD": [["31/12/2024", "NEW"]], "NEW": [], "LEFT": [["31/12/2024", "RIGHT"]],
+                                   "RIGHT": []}
+            actions = corporate_actions.view(store, splits, changes)
+            shared, merged_shared = store._shared, actions.merged_prices._shared
+            ndq_run, right_run = shared._runs["NDQ"], merged_shared._runs["RIGHT"]
+
+            with open(source_path, "a", encoding="utf-8") as source_file:
+                source_file.write("2025-01-02,NEW,12.00\n")
+            earliest = append_price_rows(store, source_path, offset)
+            corporate_actions.refresh_prices(store, earliest, {"NEW"})
+            self.assertIs(corporate_actions.view(store, splits, changes), actions)
+            self.assertIs(store._shared, shared)
+            self.assertIs(shared._runs["NDQ"], ndq_run)
+            self.assertIs(actions.merged_prices._shared, merged_shared)
+            self.assertIs(merged_shared._runs["RIGHT"], right_run)
+            self.assertEqual(actions.close_on_or_before("OLD", date(2025, 1, 3)), (date(2025, 1, 2), 12.0))
+            self.assertEqual(actions.close_on_or_before("LEFT", date(2025, 1, 3)), (date(2024, 12, 31), 6.0))
+
+    def test_concurrent_load_matches_cached_read(self):
+        from functools import partial
+        import loader
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(snapshot_cache, "CACHE_DIR", os.path.join(directory, "cache")), \
+                mock.patch.object(loader.os, "cpu_count", return_value=2):
+            paths = {}
+            for name, ticker in (("prices.csv", "NDQ"), ("other.csv", "HACK")):
+                paths[name] = os.path.join(directory, name)
+                with open(paths[name], "w", encoding="utf-8") as source_file:
+                    source_file.write(f"date,ticker,close_price\n2024-12-30,{ticker},40.00\n2024-12-31,{ticker},41.00")
+            sources = {path: (partial(read_price_store, path), "test", None) for path in paths.values()}
+
+            # prices.csv has no snapshot yet so it is parsed in a worker process, which saves one
+            self.assertTrue(loader.parse_in_process(paths["prices.csv"], "test", True))
+            loaded = loader.load_sources(sources, heavy=[paths["prices.csv"]])
+            for path in paths.values():
+                self.assertEqual(list(loaded[path].closes(loaded[path].tickers()[0])), [40.0, 41.0])
+            self.assertTrue(snapshot_cache.snapshot_usable(paths["prices.csv"], "test"))
+            self.assertFalse(loader.parse_in_process(paths["prices.csv"], "test", True))
+
+
 if __name__ == "__main__":
     unittest.main()
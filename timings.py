@@ -0,0 +1,104 @@
+"""
+Per-stage timing and profiling for the command line scripts
+--timings[=FILE]   wall time, call count and net allocated bytes per stage,
+                   as JSON on stderr or in FILE when the run ends
+--profile=FILE     cProfile stats for the whole run, for pstats or snakeviz
+Stages are module functions wrapped in place, so calls inside the module go
+through the wrapper too. Nothing is wrapped unless an option is given, so a
+normal run pays nothing. Stage times are inclusive of the stages they call
+"""
+import atexit
+import cProfile
+import functools
+import json
+import sys
+import time
+import tracemalloc
+
+# Stage name to [calls, seconds, net allocated bytes]
+_stages = {}
+_options = {}
+
+
+def parse_options(argv):
+    # argv without the timing options, and the options found
+    options = {}
+    remaining = []
+    arguments = iter(argv)
+    for argument in arguments:
+        name, _, value = argument.partition("=")
+        if name == "--timings":
+            options["timings"] = value or None
+        elif name == "--profile":
+            options["profile"] = value or next(arguments, None)
+            if not options["profile"]:
+                print("--profile needs a file to write the stats to")
+                sys.exit(1)
+        else:
+            remaining.append(argument)
+    return remaining, options
+
+
+def timed(name, function):
+    stage = _stages.setdefault(name, [0, 0.0, 0])
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start_memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stage[0] += 1
+            stage[1] += time.perf_counter() - start
+            stage[2] += tracemalloc.get_traced_memory()[0] - start_memory
+    return wrapper
+
+
+def instrument(module, names):
+    for name in names:
+        setattr(module, name, timed(name, getattr(module, name)))
+
+
+def summary(wall_seconds):
+    return {
+        "wall_seconds": round(wall_seconds, 6),
+        "stages": {
+            name: {"calls": calls, "seconds": round(seconds, 6), "net_allocated_bytes": allocated}
+            for name, (calls, seconds, allocated) in _stages.items() if calls
+        },
+    }
+
+
+def report(start, profiler):
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(_options["profile"])
+    if "timings" not in _options:
+        return
+    output = json.dumps(summary(time.perf_counter() - start), indent=2)
+    if _options["timings"]:
+        with open(_options["timings"], "w", encoding="utf-8") as timings_file:
+            timings_file.write(output + "\n")
+    else:
+        print(output, file=sys.stderr)
+
+
+def start(options, stages):
+    """
+    stages is a list of (module, function names) to time. Does nothing
+    without options; otherwise reports when the process exits, including
+    through sys.exit
+    """
+    _options.update(options)
+    if not options:
+        return
+    if "timings" in options:
+        tracemalloc.start()
+        for module, names in stages:
+            instrument(module, names)
+    profiler = None
+    if "profile" in options:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    atexit.register(report, time.perf_counter(), profiler)
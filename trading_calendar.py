@@ -0,0 +1,178 @@
+"""
+Trading calendar index for a single ticker
+Holds the ticker's close dates as sorted day ordinals, built once at load
+Weekend and holiday resolution is a bisect with no date parsing
+SharedCalendar resolves a date once for all tickers of a store
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class TradingCalendar:
+
+    def __init__(self, day_ordinals):
+        # day_ordinals must already be sorted ascending
+        self.days = day_ordinals
+
+    def __len__(self):
+        return len(self.days)
+
+    def __contains__(self, day_ordinal):
+        index = bisect_left(self.days, day_ordinal)
+        return index < len(self.days) and self.days[index] == day_ordinal
+
+    def index_on_or_before(self, day_ordinal):
+        # Position of the last close on or before day_ordinal, -1 if there isn't one
+        return bisect_right(self.days, day_ordinal) - 1
+
+    def index_before(self, day_ordinal):
+        # Position of the last close strictly before day_ordinal, -1 if there isn't one
+        return bisect_left(self.days, day_ordinal) - 1
+
+    def last_close_on_or_before(self, day_ordinal):
+        index = self.index_on_or_before(day_ordinal)
+        return self.days[index] if index >= 0 else None
+
+    def last_close_before(self, day_ordinal):
+        index = self.index_before(day_ordinal)
+        return self.days[index] if index >= 0 else None
+
+
+class SharedCalendar:
+    """
+    Union of every ticker's close dates, shared by all tickers of a store
+    A query date is resolved to a union position once and reused for every
+    ticker. Each ticker is a run of union days from its first close, with
+    the union days it has no close on kept as a bitmap plus a sorted list,
+    so its own position is a subtraction, or a short bisect over its gaps
+    """
+
+    def __init__(self, series):
+        # series maps ticker to its sorted day ordinals
+        union = set()
+        for day_ordinals in series.values():
+            union.update(day_ordinals)
+        self.days = array("l", sorted(union))
+        position = {day_ordinal: index for index, day_ordinal in enumerate(self.days)}
+        # Ticker to (first union position, last union position, gap bitmap, gap positions)
+        self._runs = {}
+        # Runs of discarded tickers, kept so update only has to add their new days
+        self._stale = {}
+        for ticker, day_ordinals in series.items():
+            if not day_ordinals:
+                continue
+            first = position[day_ordinals[0]]
+            last = position[day_ordinals[-1]]
+            if last - first + 1 == len(day_ordinals):
+                self._runs[ticker] = (first, last, None, ())
+            else:
+                self._runs[ticker] = _extend_run(None, [position[day_ordinal] for day_ordinal in day_ordinals])
+
+    def __contains__(self, ticker):
+        return ticker in self._runs
+
+    def discard(self, ticker):
+        # ticker's closes changed, it goes back to its own calendar until update takes it back in
+        run = self._runs.pop(ticker, None)
+        if run is not None:
+            self._stale[ticker] = run
+
+    def update(self, series):
+        """
+        Takes the tickers of series back in after closes were added, in place
+        New union days go on the end and a discarded ticker whose closes were
+        only added after its last one keeps its run, extended by the new days
+        Returns False, with nothing changed, when a new day falls inside the
+        union, which would move every position after it: build a new one then
+        """
+        days = self.days
+        end = days[-1] if days else None
+        added = set()
+        pending = []
+        for ticker, day_ordinals in series.items():
+            if not day_ordinals:
+                continue
+            start = 0
+            run = self._stale.get(ticker)
+            if run is not None:
+                first, last, _, gaps = run
+                # Closes are only ever added, so the old count ending on the old last day means none went before it
+                kept = last - first + 1 - len(gaps)
+                if len(day_ordinals) >= kept and day_ordinals[0] == days[first] and day_ordinals[kept - 1] == days[last]:
+                    start = kept
+                else:
+                    run = None
+            inside = start if end is None else bisect_right(day_ordinals, end, start)
+            for day_ordinal in day_ordinals[start:inside]:
+                index = bisect_left(days, day_ordinal)
+                if days[index] != day_ordinal:
+                    return False
+            added.update(day_ordinals[inside:])
+            pending.append((ticker, day_ordinals, start, run))
+        days.extend(sorted(added))
+        for ticker, day_ordinals, start, run in pending:
+            positions = [bisect_left(days, day_ordinal) for day_ordinal in day_ordinals[start:]]
+            self._runs[ticker] = _extend_run(run, positions) if positions else run
+            self._stale.pop(ticker, None)
+        return True
+
+    def resolve(self, day_ordinal):
+        # Union position of the last exchange day on or before day_ordinal, -1 if none
+        return bisect_right(self.days, day_ordinal) - 1
+
+    def has_close(self, ticker, day_ordinal):
+        first, last, bitmap, _ = self._runs[ticker]
+        position = self.resolve(day_ordinal)
+        if position < first or position > last or self.days[position] != day_ordinal:
+            return False
+        offset = position - first
+        return bitmap is None or bool(bitmap[offset >> 3] >> (offset & 7) & 1)
+
+    def index_on_or_before(self, ticker, day_ordinal):
+        # Position in ticker's own arrays of its last close on or before day_ordinal, -1 if none
+        first, last, _, gaps = self._runs[ticker]
+        position = min(self.resolve(day_ordinal), last)
+        if position < first:
+            return -1
+        return position - first - (bisect_right(gaps, position) if gaps else 0)
+
+    def indexes_on_or_before(self, tickers, day_ordinal):
+        # index_on_or_before for many tickers, with the date resolved once
+        resolved = self.resolve(day_ordinal)
+        runs = self._runs
+        indexes = []
+        for ticker in tickers:
+            first, last, _, gaps = runs[ticker]
+            position = resolved if resolved < last else last
+            if position < first:
+                indexes.append(-1)
+            else:
+                indexes.append(position - first - (bisect_right(gaps, position) if gaps else 0))
+        return indexes
+
+
+def _extend_run(run, positions):
+    # run carried on over the sorted union positions after its last one, a new run when run is None
+    if run is None:
+        first, last, bitmap, gaps = positions[0], positions[0] - 1, None, ()
+    else:
+        first, last, bitmap, gaps = run
+    end = positions[-1]
+    if bitmap is None and end - last == len(positions):
+        return first, end, None, ()
+    present = bytearray((end - first) // 8 + 1)
+    if bitmap is None:
+        # No gaps so far, every position up to last is present
+        full, rest = divmod(last - first + 1, 8)
+        present[:full] = b"\xff" * full
+        if rest:
+            present[full] = (1 << rest) - 1
+    else:
+        present[:len(bitmap)] = bitmap
+    for position in positions:
+        offset = position - first
+        present[offset >> 3] |= 1 << (offset & 7)
+    gaps = array("l", gaps)
+    gaps.extend(position for position in range(last + 1, end + 1)
+                if not present[(position - first) >> 3] >> ((position - first) & 7) & 1)
+    return first, end, present, gaps
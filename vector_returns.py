@@ -0,0 +1,159 @@
+"""
+Vectorized investment return engine using NumPy
+Every lot in the portfolio becomes a row in flat arrays
+(customer index, ticker index, purchase date ordinal, shares, cost basis)
+Start value, contributions and current value are computed for all customers
+at once with masks and summed per customer with np.bincount
+Gives the same numbers as get_ticker_prices_for_timeframe + get_invest_return
+"""
+import numpy as np
+
+
+class LotArrays:
+
+    def __init__(self, portfolio_data):
+        # portfolio_data is a PortfolioStore, whose lots are already in customer order
+        self.customer_ids = list(portfolio_data)
+        self.customer_index = {customer_id: index for index, customer_id in enumerate(self.customer_ids)}
+        self.tickers = []
+        self.ticker_index = {}
+
+        holding_tickers = []
+        for ticker in portfolio_data.holding_tickers:
+            if ticker not in self.ticker_index:
+                self.ticker_index[ticker] = len(self.tickers)
+                self.tickers.append(ticker)
+            holding_tickers.append(self.ticker_index[ticker])
+        holdings_per_customer = [end - first for first, end in map(portfolio_data.customer_holdings, self.customer_ids)]
+        holding_customer = np.repeat(np.arange(len(self.customer_ids), dtype=np.int64), holdings_per_customer)
+        lots_per_holding = np.diff(np.array(portfolio_data.holding_lots, dtype=np.int64))
+
+        self.customer = np.repeat(holding_customer, lots_per_holding)
+        self.ticker = np.repeat(np.array(holding_tickers, dtype=np.int64), lots_per_holding)
+        self.purchase_date = np.array(portfolio_data.purchase_dates, dtype=np.int64)
+        self.shares = np.array(portfolio_data.shares, dtype=np.float64)
+        self.cost_basis = np.array(portfolio_data.cost_basis, dtype=np.float64)
+
+        # Lot positions grouped by ticker so per ticker work skips the other lots
+        self._by_ticker = np.argsort(self.ticker, kind="stable")
+        self._ticker_bounds = np.searchsorted(self.ticker[self._by_ticker], np.arange(len(self.tickers) + 1))
+
+    def __len__(self):
+        return len(self.customer)
+
+    def lots_of(self, ticker):
+        number = self.ticker_index[ticker]
+        return self._by_ticker[self._ticker_bounds[number]:self._ticker_bounds[number + 1]]
+
+
+def split_adjusted_shares(engine, lots, end_ordinal):
+    # Vector form of handle_split_customer_position, splits after each lot's purchase date up to end_ordinal
+    actions = engine.get_corporate_actions()
+    split_ratio = np.ones(len(lots))
+    for ticker in lots.tickers:
+        if actions.has_splits(ticker):
+            ticker_lots = lots.lots_of(ticker)
+            split_ratio[ticker_lots] = actions.split_factors(ticker, lots.purchase_date[ticker_lots], end_ordinal)
+    return lots.shares * split_ratio
+
+
+def ticker_price_arrays(engine, lots, timeframe, ticker_price_cache):
+    ticker_count = len(lots.tickers)
+    start_price = np.zeros(ticker_count)
+    end_price = np.zeros(ticker_count)
+    start_date = np.zeros(ticker_count, dtype=np.int64)
+    end_date = np.zeros(ticker_count, dtype=np.int64)
+    missing = np.zeros(ticker_count, dtype=bool)
+    ticker_prices = engine.get_cached_ticker_prices(lots.tickers, timeframe, ticker_price_cache)
+    for ticker, number in lots.ticker_index.items():
+        ticker_price = ticker_prices[ticker]
+        if ticker_price is None:
+            missing[number] = True
+            continue
+        start_price[number] = ticker_price["start_price"]
+        end_price[number] = ticker_price["end_price"]
+        start_date[number] = ticker_price["start_date"].toordinal()
+        end_date[number] = ticker_price["end_date"].toordinal()
+    return start_price, end_price, start_date, end_date, missing
+
+
+def portfolio_totals(engine, lots, timeframe, ticker_price_cache):
+    start_price, end_price, start_date, end_date, missing = ticker_price_arrays(
+        engine, lots, timeframe, ticker_price_cache)
+    end_ordinal = int(end_date[~missing].max(initial=0))
+    shares = split_adjusted_shares(engine, lots, end_ordinal)
+
+    lot_start = start_date[lots.ticker]
+    lot_end = end_date[lots.ticker]
+    owned_at_start = lots.purchase_date <= lot_start
+    contributed = ~owned_at_start & (lots.purchase_date <= lot_end)
+
+    customer_count = len(lots.customer_ids)
+    start_total = np.bincount(lots.customer, weights=np.where(owned_at_start, start_price[lots.ticker] * shares, 0.0),
+                              minlength=customer_count)
+    contribution_total = np.bincount(lots.customer, weights=np.where(contributed, lots.cost_basis * lots.shares, 0.0),
+                                     minlength=customer_count)
+    held_at_end = lots.purchase_date <= lot_end
+    current_total = np.bincount(lots.customer, weights=np.where(held_at_end, end_price[lots.ticker] * shares, 0.0),
+                                minlength=customer_count)
+
+    # Customers holding a ticker without prices for the period
+    customer_missing = np.zeros(customer_count, dtype=bool)
+    customer_missing[lots.customer[missing[lots.ticker]]] = True
+    return start_total, current_total, contribution_total, customer_missing
+
+
+def calc_investment_returns(start_total, current_total, contribution_total):
+    # Vector form of calc_investment_return
+    with np.errstate(divide="ignore", invalid="ignore"):
+        from_contributions = current_total - contribution_total
+        return_dollar = np.where(start_total == 0,
+                                 np.where(contribution_total > 0, from_contributions, 0.0),
+                                 current_total - start_total - contribution_total)
+        return_percentage = np.where(start_total == 0,
+                                     np.where(contribution_total > 0, from_contributions / contribution_total * 100, 0.0),
+                                     return_dollar / start_total * 100)
+    return return_dollar, return_percentage
+
+
+def iter_vector_results(engine, customer_ids, timeframes, ticker_price_cache=None, lots=None):
+    """
+    Same rows as investment_returns.iter_batch_results.
+    engine is the loaded investment_returns module.
+    """
+    if ticker_price_cache is None:
+        ticker_price_cache = {}
+    if lots is None:
+        lots = LotArrays(engine.portfolio_data)
+
+    by_timeframe = {}
+    for timeframe in timeframes:
+        start_total, current_total, contribution_total, customer_missing = portfolio_totals(
+            engine, lots, timeframe, ticker_price_cache)
+        return_dollar, return_percentage = calc_investment_returns(start_total, current_total, contribution_total)
+        by_timeframe[timeframe] = (start_total.tolist(), current_total.tolist(), contribution_total.tolist(),
+                                   return_dollar.tolist(), return_percentage.tolist(), customer_missing.tolist())
+
+    for customer_id in customer_ids:
+        number = lots.customer_index.get(customer_id)
+        for timeframe in timeframes:
+            if number is None:
+                yield {"customer_id": customer_id, "timeframe": timeframe, "error": "unknown customer"}
+                continue
+            start_total, current_total, contribution_total, return_dollar, return_percentage, customer_missing = \
+                by_timeframe[timeframe]
+            if customer_missing[number]:
+                ticker = engine.missing_ticker(customer_id, timeframe, ticker_price_cache)
+                yield {"customer_id": customer_id, "timeframe": timeframe,
+                       "error": f"requested period for {ticker} not found"}
+                continue
+            yield {
+                "customer_id": customer_id,
+                "timeframe": timeframe,
+                "start_total": start_total[number],
+                "current_total": current_total[number],
+                "contribution_total": contribution_total[number],
+                "return_dollar": return_dollar[number],
+                "return_percentage": return_percentage[number],
+                "error": "",
+            }